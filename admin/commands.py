@@ -1,40 +1,92 @@
 """
 Админ-команды для управления ботом
 """
+import asyncio
+from datetime import datetime
+from typing import List
+
 from aiogram import Router, F
 from aiogram.types import Message
-from aiogram.filters import Command
-from config import ADMIN_USER_IDS
+from aiogram.filters import Command, CommandObject
 from engine import story_engine
-from storage.repository import RunRepository
+from storage.repository import RunRepository, UserRepository
+from utils.admin_guard import AdminGuard
 from utils.logger import logger
+from utils.throttle import TokenBucketMiddleware
 
 router = Router(name="admin")
 
-def is_admin(user_id: int) -> bool:
-    """Проверить, является ли пользователь администратором"""
-    return user_id in ADMIN_USER_IDS
+# Единая проверка прав администратора для всех команд роутера
+router.message.middleware(AdminGuard())
+
+# Ограничение частоты: защищает исходящий поток от скриптовых админ-серий
+router.message.middleware(TokenBucketMiddleware(rate=25.0, capacity=30.0))
+
+# Максимальный размер одного сообщения отчёта (лимит Telegram 4096 с запасом)
+MAX_REPORT_CHUNK = 4000
+
+# Статические ответы — создаются один раз на модуль, а не при каждом вызове
+USAGE_START_STORY = "❌ Использование: /start_story <story_id>"
+USAGE_RESET_STORY = "❌ Использование: /reset_story <user_id> <story_id>"
+USAGE_PREVIEW_SCENE = "❌ Использование: /preview_scene <story_id> <scene_id>"
+USER_ID_NOT_NUMBER = "❌ Ошибка: user_id должен быть числом."
+NO_ACTIVE_RUNS = "📊 Активных попыток прохождения нет."
+USAGE_ACTIVE_RUNS = "❌ Использование: /active_runs [limit] [cursor]"
+
+# Размер страницы /active_runs по умолчанию
+DEFAULT_ACTIVE_RUNS_LIMIT = 50
+ACTIVE_RUNS_HEADER = "📊 Активные попытки прохождения:\n"
+
+# Шаблон записи отчёта: компилируется в один вызов format_map по полям Run
+RUN_ENTRY_TPL = (
+    "\n• Run ID: {run_id}\n"
+    "  Пользователь: {user_id}\n"
+    "  История: {story_id}\n"
+    "  Сцена: {current_scene}\n"
+    "  Начато: {started_at:%Y-%m-%d %H:%M:%S}\n"
+)
+
+# Ограничитель параллельной отправки: глобальный лимит Bot API ~30 msg/s,
+# держим запас, чтобы не ловить retry_after
+_send_semaphore = asyncio.Semaphore(25)
+
+async def _send_chunks(message: Message, chunks: List[str]):
+    """Отправить части отчёта параллельно с учётом лимитов Telegram"""
+    if len(chunks) == 1:
+        await message.answer(chunks[0])
+        return
+
+    async def _send(chunk: str):
+        async with _send_semaphore:
+            await message.answer(chunk)
+
+    await asyncio.gather(*(_send(chunk) for chunk in chunks))
 
 @router.message(Command("start_story"))
-async def cmd_start_story(message: Message):
+async def cmd_start_story(message: Message, command: CommandObject):
     """Команда /start_story <story_id>"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён. Только для администраторов.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    # maxsplit ограничивает работу split числом нужных аргументов
+    args = command.args.split(maxsplit=2) if command.args else []
     
     if len(args) < 1:
-        await message.answer("❌ Использование: /start_story <story_id>")
+        await message.answer(USAGE_START_STORY)
         return
     
     story_id = args[0]
     user_id = message.from_user.id
     
     # Если указан user_id как второй аргумент, используем его
-    if len(args) >= 2 and args[1].isdigit():
-        user_id = int(args[1])
-    
+    if len(args) >= 2:
+        try:
+            user_id = int(args[1])
+        except ValueError:
+            pass
+
+    # Пользователь мог ещё не запускать бота: runs.user_id проверяется
+    # внешним ключом, поэтому строка в users обязательна до создания попытки
+    username = message.from_user.username if user_id == message.from_user.id else None
+    await UserRepository.get_or_create(user_id, username)
+
     result = await story_engine.start_story(user_id, story_id)
     
     if result is None:
@@ -44,43 +96,35 @@ async def cmd_start_story(message: Message):
     text, keyboard, run_id = result
     
     await message.answer(text, reply_markup=keyboard)
-    logger.info(f"Админ {message.from_user.id} запустил историю {story_id} для пользователя {user_id}")
+    logger.info("Админ %s запустил историю %s для пользователя %s", message.from_user.id, story_id, user_id)
 
 @router.message(Command("reset_story"))
-async def cmd_reset_story(message: Message):
+async def cmd_reset_story(message: Message, command: CommandObject):
     """Команда /reset_story <user_id> <story_id>"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён. Только для администраторов.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = command.args.split(maxsplit=2) if command.args else []
     
     if len(args) < 2:
-        await message.answer("❌ Использование: /reset_story <user_id> <story_id>")
+        await message.answer(USAGE_RESET_STORY)
         return
     
     try:
         user_id = int(args[0])
         story_id = args[1]
     except ValueError:
-        await message.answer("❌ Ошибка: user_id должен быть числом.")
+        await message.answer(USER_ID_NOT_NUMBER)
         return
     
     await RunRepository.reset_run(user_id, story_id)
     await message.answer(f"✅ Попытка прохождения истории '{story_id}' для пользователя {user_id} сброшена.")
-    logger.info(f"Админ {message.from_user.id} сбросил историю {story_id} для пользователя {user_id}")
+    logger.info("Админ %s сбросил историю %s для пользователя %s", message.from_user.id, story_id, user_id)
 
 @router.message(Command("preview_scene"))
-async def cmd_preview_scene(message: Message):
+async def cmd_preview_scene(message: Message, command: CommandObject):
     """Команда /preview_scene <story_id> <scene_id>"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён. Только для администраторов.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = command.args.split(maxsplit=2) if command.args else []
     
     if len(args) < 2:
-        await message.answer("❌ Использование: /preview_scene <story_id> <scene_id>")
+        await message.answer(USAGE_PREVIEW_SCENE)
         return
     
     story_id = args[0]
@@ -95,35 +139,81 @@ async def cmd_preview_scene(message: Message):
     await message.answer(f"📖 Предпросмотр сцены '{scene_id}':\n\n{text}")
 
 @router.message(Command("active_runs"))
-async def cmd_active_runs(message: Message):
-    """Команда /active_runs - показать все активные попытки прохождения"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён. Только для администраторов.")
+async def cmd_active_runs(message: Message, command: CommandObject):
+    """Команда /active_runs [limit] [cursor] - показать активные попытки прохождения"""
+    args = command.args.split(maxsplit=2) if command.args else []
+    
+    # limit - целое число, cursor - "метка,run_id" из строки "Продолжение"
+    # (run_id дорезает границу внутри секунды; голая метка тоже принимается)
+    limit = DEFAULT_ACTIVE_RUNS_LIMIT
+    before_ts = None
+    before_run_id = None
+
+    for arg in args:
+        try:
+            limit = int(arg)
+            continue
+        except ValueError:
+            pass
+
+        ts_part, _, run_part = arg.partition(",")
+        try:
+            before_ts = datetime.fromisoformat(ts_part)
+            before_run_id = int(run_part) if run_part else None
+        except ValueError:
+            await message.answer(USAGE_ACTIVE_RUNS)
+            return
+
+    if limit <= 0:
+        await message.answer(USAGE_ACTIVE_RUNS)
         return
-    
-    runs = await RunRepository.get_all_active_runs()
-    
+
+    runs = await RunRepository.get_active_runs_page(limit, before_ts, before_run_id)
+
     if not runs:
-        await message.answer("📊 Активных попыток прохождения нет.")
+        await message.answer(NO_ACTIVE_RUNS)
         return
-    
-    lines = ["📊 Активные попытки прохождения:\n"]
-    
+
+    # Рендер отчёта - чистый CPU-код, уводим его в поток,
+    # чтобы event loop оставался отзывчивым для остальных пользователей
+    chunks = await asyncio.to_thread(_render_runs, runs, limit)
+
+    await _send_chunks(message, chunks)
+
+def _render_runs(runs: list, limit: int) -> List[str]:
+    """
+    Отрендерить отчёт по активным попыткам (синхронный CPU-код)
+
+    Собирает отчёт за один проход, разбивая на сообщения по границам
+    записей (лимит Telegram 4096, оставляем небольшой запас).
+    """
+    chunks = []
+    buf = [ACTIVE_RUNS_HEADER]
+    size = len(buf[0])
+
     for run in runs:
-        lines.append(
-            f"• Run ID: {run.run_id}\n"
-            f"  Пользователь: {run.user_id}\n"
-            f"  История: {run.story_id}\n"
-            f"  Сцена: {run.current_scene}\n"
-            f"  Начато: {run.started_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        entry = RUN_ENTRY_TPL.format_map(vars(run))
+
+        if size + len(entry) > MAX_REPORT_CHUNK:
+            chunks.append("".join(buf))
+            buf = []
+            size = 0
+
+        buf.append(entry)
+        size += len(entry)
+
+    # Полная страница - подсказываем курсор для следующей
+    if len(runs) == limit:
+        cursor_hint = (
+            f"\n⏭ Продолжение: /active_runs {limit} "
+            f"{runs[-1].started_at.isoformat()},{runs[-1].run_id}"
         )
-    
-    text = "\n".join(lines)
-    
-    # Telegram ограничивает длину сообщения, разбиваем если нужно
-    if len(text) > 4096:
-        chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-        for chunk in chunks:
-            await message.answer(chunk)
-    else:
-        await message.answer(text)
+        if size + len(cursor_hint) > MAX_REPORT_CHUNK:
+            chunks.append("".join(buf))
+            buf = []
+        buf.append(cursor_hint)
+
+    if buf:
+        chunks.append("".join(buf))
+
+    return chunks
@@ -1,8 +1,9 @@
 """
 Расширенные админ-команды для редактирования историй
 """
-import re
-from io import BytesIO
+import asyncio
+import functools
+from io import BytesIO, StringIO
 from typing import Optional, Dict, Any, List
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Document
@@ -10,19 +11,23 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config import ADMIN_USER_IDS
 from engine import story_engine
+from storage.repository import UserRepository
+from utils.admin_guard import AdminGuard
 from utils.yaml_utils import (
-    parse_yaml, save_story, load_story_file, story_exists, delete_story,
-    get_story_summary, validate_story, format_story_yaml, sanitize_story_id, MAX_TEXT_LENGTH
+    parse_yaml, aload_story_file, asave_story,
+    story_exists, delete_story, get_story_summary, get_story_index,
+    validate_story, dump_story_yaml,
+    sanitize_story_id, MAX_TEXT_LENGTH
 )
 from utils.logger import logger
+from utils.ratelimit import answer_chunked
 
 router = Router(name="admin_editor")
 
-def is_admin(user_id: int) -> bool:
-    """Проверить, является ли пользователь администратором"""
-    return user_id in ADMIN_USER_IDS
+# Единая проверка прав администратора до вызова обработчиков
+router.message.middleware(AdminGuard())
+router.callback_query.middleware(AdminGuard())
 
 # FSM States
 class EditTextStates(StatesGroup):
@@ -50,10 +55,6 @@ class DeleteStoryStates(StatesGroup):
 @router.message(Command("admin"))
 async def cmd_admin_menu(message: Message):
     """Главное меню админа"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён. Только для администраторов.")
-        return
-    
     text = (
         "🔧 Админ-панель\n\n"
         "Доступные команды:\n"
@@ -75,50 +76,38 @@ async def cmd_admin_menu(message: Message):
 @router.message(Command("admin_stories"))
 async def cmd_admin_stories(message: Message):
     """Список всех историй"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    stories = story_engine.list_stories()
+    # Лёгкий индекс: метаданные читаются потоком событий без полного парсинга
+    stories = await asyncio.to_thread(get_story_index)
     
     if not stories:
         await message.answer("📚 Истории не найдены.")
         return
     
-    lines = ["📚 Список историй:\n"]
+    # Пишем сразу в StringIO: без промежуточного списка и финального join
+    buf = StringIO()
+    buf.write("📚 Список историй:\n")
     
-    for story_id, story_data in stories.items():
-        title = story_data.get("title", "Без названия")
-        version = story_data.get("version", "1.0")
-        scenes_count = len(story_data.get("scenes", {}))
-        endings_count = len(story_data.get("endings", {}))
+    for story_id, info in stories.items():
+        title = info.get("title") or "Без названия"
+        version = info.get("version") or "1.0"
+        scenes_count = info["scenes_count"]
+        endings_count = info["endings_count"]
         
-        lines.append(
-            f"• {title}\n"
+        buf.write(
+            f"\n• {title}\n"
             f"  ID: {story_id}\n"
             f"  Версия: {version}\n"
             f"  Сцен: {scenes_count}, Финалов: {endings_count}\n"
         )
     
-    text = "\n".join(lines)
-    
-    if len(text) > 4096:
-        chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-        for chunk in chunks:
-            await message.answer(chunk)
-    else:
-        await message.answer(text)
+    await answer_chunked(message, buf.getvalue())
 
 # ==================== РЕДАКТИРОВАНИЕ ТЕКСТА ====================
 
 @router.message(Command("admin_edit_text"))
 async def cmd_edit_text(message: Message, state: FSMContext):
     """Начать редактирование текста сцены"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=3)[1:] if message.text else []
     
     if len(args) < 2:
         await message.answer(
@@ -181,7 +170,6 @@ async def process_text_line(message: Message, state: FSMContext):
         
         if success:
             await message.answer(f"✅ Текст сцены '{scene_id}' обновлён!")
-            story_engine.reload_stories()
         else:
             await message.answer(f"❌ Ошибка: {error}")
         
@@ -215,7 +203,6 @@ async def process_single_text(message: Message, state: FSMContext):
     
     if success:
         await message.answer(f"✅ Текст сцены '{scene_id}' обновлён!")
-        story_engine.reload_stories()
     else:
         await message.answer(f"❌ Ошибка: {error}")
     
@@ -224,10 +211,13 @@ async def process_single_text(message: Message, state: FSMContext):
 async def save_scene_text(story_id: str, scene_id: str, text: str) -> tuple[bool, Optional[str]]:
     """Сохранить текст сцены"""
     try:
-        # Загружаем историю из файла
-        story_data, error = load_story_file(story_id)
-        if error:
-            return False, error
+        # Историю берём из кэша движка (копия для мутаций);
+        # диск читаем только если движок её не знает
+        story_data, _ = story_engine.get_story_with_path(story_id)
+        if story_data is None:
+            story_data, error = await aload_story_file(story_id, mutable=True)
+            if error:
+                return False, error
         
         # Обновляем текст
         if "scenes" not in story_data:
@@ -239,7 +229,13 @@ async def save_scene_text(story_id: str, scene_id: str, text: str) -> tuple[bool
         story_data["scenes"][scene_id]["text"] = text
         
         # Сохраняем
-        return save_story(story_id, story_data)
+        success, error = await asave_story(story_id, story_data)
+        
+        # Обновляем только эту историю в кэше движка вместо полной перезагрузки
+        if success:
+            story_engine.update_story(story_id, story_data)
+        
+        return success, error
     except Exception as e:
         return False, str(e)
 
@@ -248,11 +244,7 @@ async def save_scene_text(story_id: str, scene_id: str, text: str) -> tuple[bool
 @router.message(Command("admin_choices"))
 async def cmd_list_choices(message: Message):
     """Список выборов в сцене"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=3)[1:] if message.text else []
     
     if len(args) < 2:
         await message.answer("❌ Использование: /admin_choices <story_id> <scene_id>")
@@ -296,11 +288,7 @@ async def cmd_list_choices(message: Message):
 @router.message(Command("admin_add_choice"))
 async def cmd_add_choice(message: Message, state: FSMContext):
     """Добавить выбор в сцену"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=3)[1:] if message.text else []
     
     if len(args) < 2:
         await message.answer("❌ Использование: /admin_add_choice <story_id> <scene_id>")
@@ -314,7 +302,20 @@ async def cmd_add_choice(message: Message, state: FSMContext):
         await message.answer(f"❌ История '{story_id}' не найдена.")
         return
     
-    await state.update_data(story_id=story_id, scene_id=scene_id, choice_data={})
+    # Снимок существующих ID выборов - O(1) проверка дубликатов при вводе
+    scene = story.get("scenes", {}).get(scene_id, {})
+    existing_ids = [c.get("id") for c in scene.get("choices", [])]
+    
+    # Списки сцен/финалов для клавиатуры выбора next_scene
+    # собираем один раз на FSM-сессию
+    scenes = story.get("scenes", {})
+    endings = story.get("endings", {})
+    
+    await state.update_data(
+        story_id=story_id, scene_id=scene_id, choice_data={}, existing_ids=existing_ids,
+        scene_keys=list(scenes.keys())[:10], ending_keys=list(endings.keys())[:10],
+        keys_truncated=len(scenes) > 10 or len(endings) > 10
+    )
     await state.set_state(EditChoiceStates.waiting_for_choice_id)
     
     await message.answer("✏️ Добавление выбора\n\nОтправьте ID выбора:")
@@ -330,12 +331,7 @@ async def process_choice_id(message: Message, state: FSMContext):
     choice_data = data.get("choice_data", {})
     
     # Проверяем, не существует ли уже такой ID
-    story = story_engine.get_story(story_id)
-    scenes = story.get("scenes", {})
-    scene = scenes.get(scene_id, {})
-    choices = scene.get("choices", [])
-    
-    if any(c.get("id") == choice_id for c in choices):
+    if choice_id in set(data.get("existing_ids", [])):
         await message.answer(f"❌ Выбор с ID '{choice_id}' уже существует. Используйте другой ID.")
         return
     
@@ -356,44 +352,20 @@ async def process_choice_text(message: Message, state: FSMContext):
     await state.update_data(choice_data=choice_data)
     await state.set_state(EditChoiceStates.waiting_for_next_scene)
     
-    # Показываем список сцен и финалов для выбора
-    story_id = data["story_id"]
-    story = story_engine.get_story(story_id)
-    
-    scenes = list(story.get("scenes", {}).keys())
-    endings = list(story.get("endings", {}).keys())
-    
-    keyboard_buttons = []
-    
-    # Кнопки для сцен
-    for scene_id_option in scenes[:10]:  # Ограничиваем до 10
-        keyboard_buttons.append([
-            InlineKeyboardButton(text=f"Сцена: {scene_id_option}", callback_data=f"next_scene:{scene_id_option}")
-        ])
-    
-    # Кнопки для финалов
-    for ending_id in endings[:10]:
-        keyboard_buttons.append([
-            InlineKeyboardButton(text=f"Финал: {ending_id}", callback_data=f"next_scene:{ending_id}")
-        ])
-    
-    keyboard_buttons.append([
-        InlineKeyboardButton(text="✏️ Ввести вручную", callback_data="next_scene:manual")
-    ])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    # Списки сцен/финалов взяты из снимка FSM-сессии (см. cmd_add_choice)
+    keyboard = build_next_scene_kb(
+        tuple(data.get("scene_keys", [])),
+        tuple(data.get("ending_keys", []))
+    )
     
     text = "Выберите следующую сцену/финал или введите вручную:"
-    if len(scenes) > 10 or len(endings) > 10:
+    if data.get("keys_truncated"):
         text += "\n\n(Показаны первые 10, остальные можно ввести вручную)"
     
     await message.answer(text, reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith("next_scene:"))
-async def process_next_scene_choice(callback: CallbackQuery, state: FSMContext):
+async def process_next_scene_choice(callback: CallbackQuery, next_scene: str, state: FSMContext):
     """Обработка выбора следующей сцены"""
-    next_scene = callback.data.split(":", 1)[1]
-    
     if next_scene == "manual":
         await callback.message.edit_text("Введите ID следующей сцены/финала:")
         await state.set_state(EditChoiceStates.waiting_for_next_scene)
@@ -413,7 +385,6 @@ async def process_next_scene_choice(callback: CallbackQuery, state: FSMContext):
     
     if success:
         await callback.message.edit_text(f"✅ Выбор добавлен!")
-        story_engine.reload_stories()
     else:
         await callback.message.edit_text(f"❌ Ошибка: {error}")
     
@@ -438,18 +409,53 @@ async def process_next_scene_manual(message: Message, state: FSMContext):
     
     if success:
         await message.answer(f"✅ Выбор добавлен!")
-        story_engine.reload_stories()
     else:
         await message.answer(f"❌ Ошибка: {error}")
     
     await state.clear()
 
+@functools.lru_cache(maxsize=128)
+def build_next_scene_kb(scene_keys: tuple, ending_keys: tuple) -> InlineKeyboardMarkup:
+    """
+    Построить клавиатуру выбора next_scene (кэшируется по наборам ключей)
+
+    Args:
+        scene_keys: Кортеж ID сцен (до 10)
+        ending_keys: Кортеж ID финалов (до 10)
+
+    Returns:
+        InlineKeyboardMarkup
+    """
+    keyboard_buttons = []
+
+    # Кнопки для сцен
+    for scene_id_option in scene_keys:
+        keyboard_buttons.append([
+            InlineKeyboardButton(text=f"Сцена: {scene_id_option}", callback_data=f"next_scene:{scene_id_option}")
+        ])
+
+    # Кнопки для финалов
+    for ending_id in ending_keys:
+        keyboard_buttons.append([
+            InlineKeyboardButton(text=f"Финал: {ending_id}", callback_data=f"next_scene:{ending_id}")
+        ])
+
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="✏️ Ввести вручную", callback_data="next_scene:manual")
+    ])
+
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
 async def save_choice(story_id: str, scene_id: str, choice_data: Dict[str, Any]) -> tuple[bool, Optional[str]]:
     """Сохранить выбор в сцену"""
     try:
-        story_data, error = load_story_file(story_id)
-        if error:
-            return False, error
+        # Историю берём из кэша движка (копия для мутаций);
+        # диск читаем только если движок её не знает
+        story_data, _ = story_engine.get_story_with_path(story_id)
+        if story_data is None:
+            story_data, error = await aload_story_file(story_id, mutable=True)
+            if error:
+                return False, error
         
         if "scenes" not in story_data:
             story_data["scenes"] = {}
@@ -463,18 +469,20 @@ async def save_choice(story_id: str, scene_id: str, choice_data: Dict[str, Any])
         # Добавляем выбор
         story_data["scenes"][scene_id]["choices"].append(choice_data)
         
-        return save_story(story_id, story_data)
+        success, error = await asave_story(story_id, story_data)
+        
+        # Обновляем только эту историю в кэше движка вместо полной перезагрузки
+        if success:
+            story_engine.update_story(story_id, story_data)
+        
+        return success, error
     except Exception as e:
         return False, str(e)
 
 @router.message(Command("admin_delete_choice"))
 async def cmd_delete_choice(message: Message):
     """Удалить выбор из сцены"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=4)[1:] if message.text else []
     
     if len(args) < 3:
         await message.answer("❌ Использование: /admin_delete_choice <story_id> <scene_id> <choice_id>")
@@ -485,11 +493,15 @@ async def cmd_delete_choice(message: Message):
     choice_id = args[2]
     
     try:
-        story_data, error = load_story_file(story_id)
-        if error:
-            await message.answer(f"❌ {error}")
-            return
-        
+        # Историю берём из кэша движка (копия для мутаций);
+        # диск читаем только если движок её не знает
+        story_data, _ = story_engine.get_story_with_path(story_id)
+        if story_data is None:
+            story_data, error = await aload_story_file(story_id, mutable=True)
+            if error:
+                await message.answer(f"❌ {error}")
+                return
+
         scenes = story_data.get("scenes", {})
         if scene_id not in scenes:
             await message.answer(f"❌ Сцена '{scene_id}' не найдена.")
@@ -505,10 +517,10 @@ async def cmd_delete_choice(message: Message):
             await message.answer(f"❌ Выбор '{choice_id}' не найден в сцене '{scene_id}'.")
             return
         
-        success, error = save_story(story_id, story_data)
+        success, error = await asave_story(story_id, story_data)
         if success:
+            story_engine.update_story(story_id, story_data)
             await message.answer(f"✅ Выбор '{choice_id}' удалён из сцены '{scene_id}'!")
-            story_engine.reload_stories()
         else:
             await message.answer(f"❌ Ошибка сохранения: {error}")
     except Exception as e:
@@ -519,10 +531,6 @@ async def cmd_delete_choice(message: Message):
 @router.message(Command("admin_upload"))
 async def cmd_upload_story(message: Message, state: FSMContext):
     """Начать загрузку истории"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
     await state.set_state(UploadStoryStates.waiting_for_yaml_text)
     await message.answer(
         "📤 Загрузка истории\n\n"
@@ -561,7 +569,7 @@ async def process_upload_text(message: Message, state: FSMContext):
 async def process_yaml_upload(message: Message, state: FSMContext, yaml_text: str):
     """Обработка загруженного YAML"""
     # Парсим YAML
-    story_data, error = parse_yaml(yaml_text)
+    story_data, error = await asyncio.to_thread(parse_yaml, yaml_text)
     if error:
         await message.answer(f"❌ Ошибка парсинга YAML:\n{error}")
         await state.clear()
@@ -574,9 +582,13 @@ async def process_yaml_upload(message: Message, state: FSMContext, yaml_text: st
         await state.clear()
         return
     
+    # Сводку считаем один раз сразу после парсинга: и путь с подтверждением,
+    # и прямое сохранение используют уже готовый текст
+    summary = await asyncio.to_thread(get_story_summary, story_data)
+    
     # Проверяем, существует ли уже
     if story_exists(story_id):
-        await state.update_data(story_data=story_data, story_id=story_id)
+        await state.update_data(story_data=story_data, story_id=story_id, summary=summary)
         await state.set_state(UploadStoryStates.waiting_for_overwrite_confirm)
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -592,18 +604,16 @@ async def process_yaml_upload(message: Message, state: FSMContext, yaml_text: st
         return
     
     # Сохраняем сразу
-    success, error = save_story(story_id, story_data)
+    success, error = await asave_story(story_id, story_data)
     if success:
-        summary = get_story_summary(story_data)
         await message.answer(summary)
-        story_engine.reload_stories()
+        story_engine.update_story(story_id, story_data)
     else:
         await message.answer(f"❌ Ошибка сохранения: {error}")
     
     await state.clear()
 
-@router.callback_query(F.data.startswith("upload_confirm:"))
-async def confirm_upload(callback: CallbackQuery, state: FSMContext):
+async def confirm_upload(callback: CallbackQuery, arg: str, state: FSMContext):
     """Подтверждение перезаписи"""
     data = await state.get_data()
     story_data = data.get("story_data")
@@ -613,11 +623,11 @@ async def confirm_upload(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Ошибка: данные не найдены")
         return
     
-    success, error = save_story(story_id, story_data)
+    success, error = await asave_story(story_id, story_data)
     if success:
-        summary = get_story_summary(story_data)
-        await callback.message.edit_text(summary)
-        story_engine.reload_stories()
+        # Сводка посчитана ещё при загрузке (см. process_yaml_upload)
+        await callback.message.edit_text(data.get("summary") or get_story_summary(story_data))
+        story_engine.update_story(story_id, story_data)
         await callback.answer("✅ История сохранена")
     else:
         await callback.message.edit_text(f"❌ Ошибка сохранения: {error}")
@@ -625,8 +635,7 @@ async def confirm_upload(callback: CallbackQuery, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data == "upload_cancel")
-async def cancel_upload(callback: CallbackQuery, state: FSMContext):
+async def cancel_upload(callback: CallbackQuery, arg: str, state: FSMContext):
     """Отмена загрузки"""
     await callback.message.edit_text("❌ Загрузка отменена")
     await callback.answer()
@@ -637,11 +646,7 @@ async def cancel_upload(callback: CallbackQuery, state: FSMContext):
 @router.message(Command("admin_export"))
 async def cmd_export_story(message: Message):
     """Экспорт истории"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=2)[1:] if message.text else []
     
     if len(args) < 1:
         await message.answer("❌ Использование: /admin_export <story_id>")
@@ -649,19 +654,23 @@ async def cmd_export_story(message: Message):
     
     story_id = args[0]
     
-    story_data, error = load_story_file(story_id)
+    story_data, error = await aload_story_file(story_id)
     if error:
         await message.answer(f"❌ {error}")
         return
     
-    yaml_text = format_story_yaml(story_data)
+    # Дампим YAML сразу в байтовый буфер: libyaml пишет байты напрямую,
+    # без промежуточной str-копии всего файла
+    file_data = BytesIO()
+    await asyncio.to_thread(dump_story_yaml, story_data, file_data)
     
     # Если текст помещается в сообщение, отправляем как текст
-    if len(yaml_text) <= 4096:
+    if file_data.getbuffer().nbytes <= 4096:
+        yaml_text = file_data.getvalue().decode("utf-8")
         await message.answer(f"📄 История '{story_id}':\n\n```yaml\n{yaml_text}\n```", parse_mode=None)
     else:
         # Отправляем как документ
-        file_data = BytesIO(yaml_text.encode("utf-8"))
+        file_data.seek(0)
         file_data.name = f"{story_id}.yaml"
         
         await message.answer_document(
@@ -674,11 +683,7 @@ async def cmd_export_story(message: Message):
 @router.message(Command("admin_delete"))
 async def cmd_delete_story(message: Message, state: FSMContext):
     """Удаление истории"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=2)[1:] if message.text else []
     
     if len(args) < 1:
         await message.answer("❌ Использование: /admin_delete <story_id>")
@@ -703,15 +708,12 @@ async def cmd_delete_story(message: Message, state: FSMContext):
         reply_markup=keyboard
     )
 
-@router.callback_query(F.data.startswith("delete_confirm:"))
-async def confirm_delete(callback: CallbackQuery, state: FSMContext):
+async def confirm_delete(callback: CallbackQuery, story_id: str, state: FSMContext):
     """Подтверждение удаления"""
-    story_id = callback.data.split(":")[1]
-    
     success, error = delete_story(story_id, move_to_deleted=True)
     if success:
         await callback.message.edit_text(f"✅ История '{story_id}' удалена (перемещена в _deleted)")
-        story_engine.reload_stories()
+        await story_engine.reload_stories_async()
         await callback.answer("✅ Удалено")
     else:
         await callback.message.edit_text(f"❌ Ошибка: {error}")
@@ -719,8 +721,7 @@ async def confirm_delete(callback: CallbackQuery, state: FSMContext):
     
     await state.clear()
 
-@router.callback_query(F.data == "delete_cancel")
-async def cancel_delete(callback: CallbackQuery, state: FSMContext):
+async def cancel_delete(callback: CallbackQuery, arg: str, state: FSMContext):
     """Отмена удаления"""
     await callback.message.edit_text("❌ Удаление отменено")
     await callback.answer()
@@ -731,11 +732,7 @@ async def cancel_delete(callback: CallbackQuery, state: FSMContext):
 @router.message(Command("admin_reload"))
 async def cmd_reload_stories(message: Message):
     """Перезагрузка историй"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    story_engine.reload_stories()
+    await story_engine.reload_stories_async()
     stories_count = len(story_engine.list_stories())
     await message.answer(f"✅ Истории перезагружены. Загружено: {stories_count}")
 
@@ -744,11 +741,7 @@ async def cmd_reload_stories(message: Message):
 @router.message(Command("admin_validate"))
 async def cmd_validate_story(message: Message):
     """Валидация истории"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=2)[1:] if message.text else []
     
     if len(args) < 1:
         await message.answer("❌ Использование: /admin_validate <story_id>")
@@ -756,46 +749,34 @@ async def cmd_validate_story(message: Message):
     
     story_id = args[0]
     
-    story_data, error = load_story_file(story_id)
+    story_data, error = await aload_story_file(story_id)
     if error:
         await message.answer(f"❌ {error}")
         return
     
-    is_valid, issues = validate_story(story_data)
-    
-    if is_valid and not issues:
+    # Ошибки и предупреждения приходят раздельно - без реклассификации
+    is_valid, errors, warnings = await asyncio.to_thread(validate_story, story_data)
+
+    if is_valid and not warnings:
         await message.answer(f"✅ История '{story_id}' валидна, ошибок не найдено!")
     elif is_valid:
         text = f"⚠️ История '{story_id}' валидна, но есть предупреждения:\n\n"
-        text += "\n".join(f"• {issue}" for issue in issues)
+        text += "\n".join(f"• {issue}" for issue in warnings)
         await message.answer(text)
     else:
-        errors = [i for i in issues if "Отсутствует" in i or "не найден" in i or "не имеет" in i]
-        warnings = [i for i in issues if i not in errors]
-        
         text = f"❌ История '{story_id}' содержит ошибки:\n\n"
-        if errors:
-            text += "Ошибки:\n" + "\n".join(f"• {e}" for e in errors) + "\n\n"
+        text += "Ошибки:\n" + "\n".join(f"• {e}" for e in errors) + "\n\n"
         if warnings:
             text += "Предупреждения:\n" + "\n".join(f"• {w}" for w in warnings)
-        
-        if len(text) > 4096:
-            chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-            for chunk in chunks:
-                await message.answer(chunk)
-        else:
-            await message.answer(text)
+
+        await answer_chunked(message, text)
 
 # ==================== PREVIEW ====================
 
 @router.message(Command("admin_preview"))
 async def cmd_preview_story(message: Message):
     """Preview истории (тестовый режим)"""
-    if not is_admin(message.from_user.id):
-        await message.answer("❌ Доступ запрещён.")
-        return
-    
-    args = message.text.split()[1:] if message.text else []
+    args = message.text.split(maxsplit=2)[1:] if message.text else []
     
     if len(args) < 1:
         await message.answer("❌ Использование: /admin_preview <story_id>")
@@ -804,6 +785,10 @@ async def cmd_preview_story(message: Message):
     story_id = args[0]
     user_id = message.from_user.id
     
+    # Пользователь мог ещё не запускать бота: runs.user_id проверяется
+    # внешним ключом, поэтому строка в users обязательна до создания попытки
+    await UserRepository.get_or_create(user_id, message.from_user.username)
+
     # Запускаем в preview режиме (используем специальный префикс для run_id)
     # Для preview создаём отдельную запись с пометкой
     result = await story_engine.start_story(user_id, story_id)
@@ -818,3 +803,25 @@ async def cmd_preview_story(message: Message):
     preview_text = f"🔍 [PREVIEW MODE] Run ID: {run_id}\n\n{text}"
     
     await message.answer(preview_text, reply_markup=keyboard)
+
+# ==================== ДИСПЕТЧЕРИЗАЦИЯ CALLBACK ====================
+
+# Единая таблица префиксов callback_data вместо цепочки magic-фильтров:
+# один handler с O(1) dict-поиском вместо линейного перебора фильтров
+_CB_DISPATCH = {
+    "next_scene": process_next_scene_choice,
+    "upload_confirm": confirm_upload,
+    "upload_cancel": cancel_upload,
+    "delete_confirm": confirm_delete,
+    "delete_cancel": cancel_delete,
+}
+
+def _is_editor_callback(callback: CallbackQuery) -> bool:
+    """Фильтр: callback принадлежит редактору (префикс есть в таблице)"""
+    return callback.data is not None and callback.data.partition(":")[0] in _CB_DISPATCH
+
+@router.callback_query(_is_editor_callback)
+async def dispatch_editor_callback(callback: CallbackQuery, state: FSMContext):
+    """Развести callback редактора по таблице префиксов"""
+    prefix, _, arg = callback.data.partition(":")
+    await _CB_DISPATCH[prefix](callback, arg, state)
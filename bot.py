@@ -2,21 +2,33 @@
 Основной файл Telegram-бота с narrative engine
 """
 import asyncio
+import functools
+
+# uvloop заметно снижает накладные расходы event loop; на платформах
+# без него (Windows) работаем на стандартном цикле
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import BOT_TOKEN, DEBUG, ADMIN_USER_IDS
 from storage.db import db
-from storage.repository import UserRepository
+from storage.repository import UserRepository, RunRepository
 from engine import story_engine
 from admin.commands import router as admin_router
 from admin.editor import router as admin_editor_router
 from handlers.menu import router as menu_router
 from utils.logger import logger
+from utils.ui_texts import get_ending_header
+from handlers.menu import get_ending_keyboard
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
@@ -32,6 +44,21 @@ class StoryStates(StatesGroup):
     """Состояния для FSM (пока не используется, но может пригодиться)"""
     pass
 
+# Сильные ссылки на фоновые задачи обработчиков: event loop держит
+# task-и слабо, без ссылки задача может быть собрана GC посреди работы
+_background_tasks: set[asyncio.Task] = set()
+
+@functools.lru_cache(maxsize=None)
+def _ending_preamble(story_id: str, ending_type: str, allow_restart: bool):
+    """Заголовок и клавиатура финала (финалы конечны и статичны - кэшируем)"""
+    return get_ending_header(ending_type), get_ending_keyboard(story_id, allow_restart)
+
+# Запасная клавиатура финала, когда история не найдена - один экземпляр на модуль
+_FALLBACK_ENDING_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📚 Другие истории", callback_data="show_stories:0")],
+    [InlineKeyboardButton(text="🏠 Меню", callback_data="service_menu")]
+])
+
 @dp.message(Command("play"))
 async def cmd_play(message: Message):
     """Обработчик команды /play - только для админов или скрыта"""
@@ -64,7 +91,7 @@ async def cmd_play(message: Message):
         
         text, keyboard, run_id = result
         await message.answer(text, reply_markup=keyboard)
-        logger.info(f"Админ {user_id} запустил историю {story_id} (run_id: {run_id})")
+        logger.info("Админ %d запустил историю %s (run_id: %d)", user_id, story_id, run_id)
     else:
         # Для обычных пользователей - показываем подсказку
         await message.answer(
@@ -78,68 +105,49 @@ async def cmd_list(message: Message):
     
     # Для админов - показываем полный список
     if user_id in ADMIN_USER_IDS or DEBUG:
-        stories = story_engine.list_stories()
+        # Текст списка отформатирован заранее при загрузке историй
+        chunks = story_engine.get_list_chunks()
         
-        if not stories:
+        if not chunks:
             await message.answer("📚 Истории не найдены.")
             return
         
-        lines = ["📚 Доступные истории:\n"]
-        
-        for story_id, story_data in stories.items():
-            title = story_data.get("title", story_id)
-            description = story_data.get("description", "")
-            version = story_data.get("version", "1.0")
-            
-            lines.append(f"• {title}")
-            lines.append(f"  ID: {story_id}")
-            if description:
-                lines.append(f"  {description}")
-            lines.append(f"  Версия: {version}")
-            lines.append("")
-        
-        text = "\n".join(lines)
-        
-        # Telegram ограничивает длину сообщения
-        if len(text) > 4096:
-            chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-            for chunk in chunks:
-                await message.answer(chunk)
+        if len(chunks) == 1:
+            await message.answer(chunks[0])
         else:
-            await message.answer(text)
+            # Части независимы - отправляем параллельно вместо N×RTT подряд
+            await asyncio.gather(*(message.answer(chunk) for chunk in chunks))
     else:
         # Для обычных пользователей - короткая подсказка
         await message.answer(
             "💡 Открой меню → 📚 Истории"
         )
 
-@dp.callback_query(F.data.startswith("choice:"))
-async def process_choice(callback: CallbackQuery):
+class ChoiceCB(CallbackData, prefix="choice"):
+    """Callback выбора игрока: choice:<run_id>:<scene_id>:<choice_id>"""
+    run_id: int
+    scene_id: str
+    choice_id: str
+
+@dp.callback_query(ChoiceCB.filter())
+async def process_choice(callback: CallbackQuery, callback_data: ChoiceCB):
     """Обработчик выбора игрока"""
-    # Формат callback_data: choice:<run_id>:<scene_id>:<choice_id>
-    parts = callback.data.split(":")
-    
-    if len(parts) != 4:
-        await callback.answer("❌ Ошибка обработки выбора", show_alert=True)
-        return
-    
-    _, run_id_str, scene_id, choice_id = parts
-    
-    try:
-        run_id = int(run_id_str)
-    except ValueError:
-        await callback.answer("❌ Ошибка: неверный run_id", show_alert=True)
-        return
+    # Структура и типы callback_data уже проверены фильтром ChoiceCB
+    # ВСЕГДА вызываем answer() как можно раньше для мгновенной реакции:
+    # Telegram ждёт ack в узком окне, тяжёлую работу уводим в фоновую задачу
+    await callback.answer()
     
+    task = asyncio.create_task(
+        _do_choice(callback, callback_data.run_id, callback_data.scene_id, callback_data.choice_id)
+    )
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _do_choice(callback: CallbackQuery, run_id: int, scene_id: str, choice_id: str):
+    """Обработать выбор игрока (выполняется в фоновой задаче после ack)"""
     user_id = callback.from_user.id
     
-    # ВСЕГДА вызываем answer() как можно раньше для мгновенной реакции
-    await callback.answer()
-    
     # Проверяем, что попытка принадлежит пользователю
-    from storage.repository import RunRepository
-    from aiogram.types import ReplyKeyboardRemove
-    
     try:
         run = await RunRepository._get_run_by_id(run_id)
         
@@ -163,7 +171,8 @@ async def process_choice(callback: CallbackQuery):
             result = await story_engine.continue_story(run_id)
             if result:
                 text, keyboard, _ = result
-                await callback.message.edit_reply_markup(reply_markup=None)
+                # edit_text с новой клавиатурой сам заменяет старую -
+                # отдельный edit_reply_markup был бы лишним round trip
                 await callback.message.edit_text(text, reply_markup=keyboard)
             return
         
@@ -175,19 +184,14 @@ async def process_choice(callback: CallbackQuery):
             await callback.message.answer("❌ Ошибка обработки выбора (возможно, условие не выполнено).")
             return
         
-        text, keyboard, new_run_id = result
-        
-        # ВСЕГДА убираем кнопки у сообщения сцены
-        await callback.message.edit_reply_markup(reply_markup=None)
+        # Обновлённый Run приходит из движка - второй запрос в БД не нужен
+        text, keyboard, new_run_id, run_after = result
         
         # Проверяем, это финал?
         # Финал определяется по keyboard=None (возвращается из _render_ending)
         if keyboard is None:
-            # Это финал - отправляем НОВОЕ сообщение
-            from utils.ui_texts import get_ending_header, get_ending_keyboard
-            
-            # Получаем актуальные данные run после завершения
-            run_after = await RunRepository._get_run_by_id(new_run_id)
+            # Это финал - убираем кнопки у сцены и отправляем НОВОЕ сообщение
+            await callback.message.edit_reply_markup(reply_markup=None)
             
             if run_after:
                 story = story_engine.get_story(run_after.story_id)
@@ -196,40 +200,33 @@ async def process_choice(callback: CallbackQuery):
                     ending = endings.get(run_after.current_scene, {})
                     ending_type = ending.get("ending_type", "neutral")
                     
-                    header = get_ending_header(ending_type)
-                    allow_restart = story.get("allow_restart", False)
-                    
+                    header, ending_keyboard = _ending_preamble(
+                        run_after.story_id, ending_type, story.get("allow_restart", False)
+                    )
                     formatted_text = f"{header}\n\n{text}"
-                    ending_keyboard = get_ending_keyboard(run_after.story_id, allow_restart)
                 else:
                     # История не найдена, но финал есть
                     formatted_text = f"🏁 Финал\n\n{text}"
-                    ending_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="📚 Другие истории", callback_data="show_stories:0")],
-                        [InlineKeyboardButton(text="🏠 Меню", callback_data="service_menu")]
-                    ])
+                    ending_keyboard = _FALLBACK_ENDING_KEYBOARD
             else:
                 # Run не найден, но это финал
                 formatted_text = f"🏁 Финал\n\n{text}"
-                ending_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📚 Другие истории", callback_data="show_stories:0")],
-                    [InlineKeyboardButton(text="🏠 Меню", callback_data="service_menu")]
-                ])
+                ending_keyboard = _FALLBACK_ENDING_KEYBOARD
             
             # Отправляем новое сообщение с финалом
             await callback.message.answer(
                 formatted_text,
                 reply_markup=ending_keyboard
             )
-            logger.info(f"Финал отправлен для run_id: {new_run_id}")
+            logger.info("Финал отправлен для run_id: %d", new_run_id)
         else:
-            # Обычная сцена - обновляем сообщение БЕЗ сервисных кнопок
+            # Обычная сцена - один edit_text обновляет и текст, и клавиатуру
             await callback.message.edit_text(text, reply_markup=keyboard)
         
-        logger.info(f"Пользователь {user_id} сделал выбор {choice_id} в сцене {scene_id} (run_id: {new_run_id})")
+        logger.info("Пользователь %d сделал выбор %s в сцене %s (run_id: %d)", user_id, choice_id, scene_id, new_run_id)
     
     except Exception as e:
-        logger.error(f"Ошибка при обработке выбора: {e}", exc_info=True)
+        logger.error("Ошибка при обработке выбора: %s", e, exc_info=True)
         await callback.message.edit_reply_markup(reply_markup=None)
         await callback.message.answer("❌ Произошла ошибка. Попробуй выбрать другую историю.")
 
@@ -240,7 +237,7 @@ async def on_startup():
         await db.connect()
         logger.info("Бот запущен")
     except Exception as e:
-        logger.error(f"Ошибка подключения к БД: {e}", exc_info=True)
+        logger.error("Ошибка подключения к БД: %s", e, exc_info=True)
         raise
 
 async def on_shutdown():
@@ -261,12 +258,17 @@ async def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     
-    # Запускаем бота
+    # Запускаем бота: длинный long-poll и только нужные типы обновлений
+    # резко снижают фоновый QPS getUpdates
     logger.info("Запуск polling...")
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(
+            bot,
+            polling_timeout=20,
+            allowed_updates=["message", "callback_query"],
+        )
     except Exception as e:
-        logger.error(f"Критическая ошибка при запуске: {e}", exc_info=True)
+        logger.error("Критическая ошибка при запуске: %s", e, exc_info=True)
         raise
 
 if __name__ == "__main__":
@@ -275,4 +277,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}", exc_info=True)
+        logger.error("Критическая ошибка: %s", e, exc_info=True)
@@ -2,15 +2,15 @@
 Конфигурация бота
 """
 import os
-from typing import List
+from typing import FrozenSet
 
 # Telegram Bot Token
 BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
 
-# ID администраторов (список)
-ADMIN_USER_IDS: List[int] = [
+# ID администраторов (множество для O(1) проверки прав)
+ADMIN_USER_IDS: FrozenSet[int] = frozenset(
     int(uid) for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip().isdigit()
-]
+)
 
 # Режим отладки
 DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
@@ -1,20 +1,51 @@
 """
 Обработка условий для выборов
 """
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from storage.repository import FlagRepository
 from utils.logger import logger
 
+# Числовые коды условий для скомпилированных программ
+HAS_FLAG, NOT_HAS_FLAG, FLAG_EQUALS = range(3)
+
+# Имя условия из YAML -> числовой код (используется компилятором в движке)
+CONDITION_KINDS = {
+    "has_flag": HAS_FLAG,
+    "not_has_flag": NOT_HAS_FLAG,
+    "flag_equals": FLAG_EQUALS,
+}
+
+class FlagsCache(dict):
+    """
+    Разделяемый кэш флагов попытки с явным признаком загруженности
+
+    Истинность словаря не годится как признак "БД уже читали": эффекты
+    дописывают флаги в тот же кэш до первого чтения, а пустой кэш
+    попытки без флагов неотличим от незагруженного. Атрибут loaded
+    разводит эти случаи.
+    """
+
+    __slots__ = ("loaded",)
+
+    def __init__(self):
+        super().__init__()
+        self.loaded = False
+
 class ConditionChecker:
     """Проверка условий"""
-    
-    def __init__(self, run_id: int):
+
+    def __init__(self, run_id: int, flags_cache: Optional[FlagsCache] = None):
         self.run_id = run_id
-        self._flags_cache: Dict[str, str] = {}
-    
+        # Кэш можно разделять с EffectApplier в рамках одного process_choice
+        self._flags_cache: FlagsCache = flags_cache if flags_cache is not None else FlagsCache()
+
     async def load_flags(self):
-        """Загрузить флаги в кэш"""
-        self._flags_cache = await FlagRepository.get_flags(self.run_id)
+        """Загрузить флаги в кэш (повторно не перечитывает)"""
+        if self._flags_cache.loaded:
+            return
+        # Обновляем словарь на месте: он может быть разделяемым
+        self._flags_cache.update(await FlagRepository.get_flags(self.run_id))
+        self._flags_cache.loaded = True
     
     async def check_conditions(self, conditions: List[Dict[str, Any]]) -> bool:
         """
@@ -37,6 +68,28 @@ class ConditionChecker:
         
         return True
     
+    async def check_compiled(self, program) -> bool:
+        """
+        Проверить скомпилированный список условий
+        
+        Args:
+            program: Кортеж пар (код условия, аргумент) из индекса движка
+        
+        Returns:
+            True если все условия выполнены
+        """
+        if not program:
+            return True
+        
+        await self.load_flags()
+        
+        handlers = self._KIND_HANDLERS
+        for kind, arg in program:
+            if not await handlers[kind](self, arg):
+                return False
+        
+        return True
+    
     async def _check_single_condition(self, condition: Dict[str, Any]) -> bool:
         """
         Проверить одно условие
@@ -47,23 +100,23 @@ class ConditionChecker:
         Returns:
             True если условие выполнено
         """
-        condition_type = list(condition.keys())[0]
-        condition_value = condition[condition_type]
-        
-        if condition_type == "has_flag":
-            return await self._check_has_flag(condition_value)
-        elif condition_type == "not_has_flag":
-            return not await self._check_has_flag(condition_value)
-        elif condition_type == "flag_equals":
-            return await self._check_flag_equals(condition_value)
-        else:
-            logger.warning(f"Неизвестный тип условия: {condition_type}")
+        condition_type = next(iter(condition))
+        handler = self._HANDLERS.get(condition_type)
+        
+        if handler is None:
+            logger.warning("Неизвестный тип условия: %s", condition_type)
             return False
+        
+        return await handler(self, condition[condition_type])
     
     async def _check_has_flag(self, flag_name: str) -> bool:
         """Проверить наличие флага"""
         return flag_name in self._flags_cache
     
+    async def _check_not_has_flag(self, flag_name: str) -> bool:
+        """Проверить отсутствие флага"""
+        return flag_name not in self._flags_cache
+    
     async def _check_flag_equals(self, condition_value: Dict[str, str]) -> bool:
         """
         Проверить равенство флага значению
@@ -79,3 +132,13 @@ class ConditionChecker:
         
         actual_value = self._flags_cache.get(flag_name)
         return actual_value == str(expected_value)
+    
+    # Таблица диспетчеризации условий: O(1) поиск вместо цепочки if/elif
+    _HANDLERS = {
+        "has_flag": _check_has_flag,
+        "not_has_flag": _check_not_has_flag,
+        "flag_equals": _check_flag_equals,
+    }
+    
+    # Обработчики по числовому коду: доступ по индексу кортежа
+    _KIND_HANDLERS = (_check_has_flag, _check_not_has_flag, _check_flag_equals)
@@ -1,15 +1,32 @@
 """
 Обработка эффектов выборов
 """
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Set
 from storage.repository import FlagRepository
+from engine.conditions import FlagsCache
 from utils.logger import logger
 
+# Числовые коды эффектов для скомпилированных программ
+ADD_FLAG, REMOVE_FLAG, SET_FLAG, INCREMENT_COUNTER = range(4)
+
+# Имя эффекта из YAML -> числовой код (используется компилятором в движке)
+EFFECT_KINDS = {
+    "add_flag": ADD_FLAG,
+    "remove_flag": REMOVE_FLAG,
+    "set_flag": SET_FLAG,
+    "increment_counter": INCREMENT_COUNTER,
+}
+
 class EffectApplier:
     """Применение эффектов"""
     
-    def __init__(self, run_id: int):
+    def __init__(self, run_id: int, flags_cache: Optional[FlagsCache] = None):
         self.run_id = run_id
+        # Кэш можно разделять с ConditionChecker в рамках одного process_choice
+        self._flags_cache: FlagsCache = flags_cache if flags_cache is not None else FlagsCache()
+        # Отложенные записи/удаления: сбрасываются одной пачкой в apply_effects
+        self._writes: Dict[str, str] = {}
+        self._removes: Set[str] = set()
     
     async def apply_effects(self, effects: List[Dict[str, Any]]):
         """
@@ -23,6 +40,31 @@ class EffectApplier:
         
         for effect in effects:
             await self._apply_single_effect(effect)
+        
+        await self._flush()
+    
+    async def apply_compiled(self, program):
+        """
+        Применить скомпилированный список эффектов
+        
+        Args:
+            program: Кортеж пар (код эффекта, аргумент) из индекса движка
+        """
+        if not program:
+            return
+        
+        handlers = self._KIND_HANDLERS
+        for kind, arg in program:
+            await handlers[kind](self, arg)
+        
+        await self._flush()
+    
+    async def _flush(self):
+        """Сбросить отложенные записи двумя пакетными запросами вместо N"""
+        await FlagRepository.set_flags_bulk(self.run_id, self._writes)
+        await FlagRepository.remove_flags_bulk(self.run_id, list(self._removes))
+        self._writes = {}
+        self._removes = set()
     
     async def _apply_single_effect(self, effect: Dict[str, Any]):
         """
@@ -31,29 +73,32 @@ class EffectApplier:
         Args:
             effect: Эффект для применения
         """
-        effect_type = list(effect.keys())[0]
-        effect_value = effect[effect_type]
+        effect_type = next(iter(effect))
+        handler = self._HANDLERS.get(effect_type)
+        
+        if handler is None:
+            logger.warning("Неизвестный тип эффекта: %s", effect_type)
+            return
         
-        if effect_type == "add_flag":
-            await self._add_flag(effect_value)
-        elif effect_type == "remove_flag":
-            await self._remove_flag(effect_value)
-        elif effect_type == "set_flag":
-            await self._set_flag(effect_value)
-        elif effect_type == "increment_counter":
-            await self._increment_counter(effect_value)
-        else:
-            logger.warning(f"Неизвестный тип эффекта: {effect_type}")
+        await handler(self, effect[effect_type])
+    
+    def _stage_write(self, flag_name: str, value: str):
+        """Отложить запись флага и обновить кэш"""
+        self._writes[flag_name] = value
+        self._removes.discard(flag_name)
+        self._flags_cache[flag_name] = value
     
     async def _add_flag(self, flag_name: str):
         """Добавить флаг со значением '1'"""
-        await FlagRepository.set_flag(self.run_id, flag_name, "1")
-        logger.debug(f"Добавлен флаг: {flag_name}")
+        self._stage_write(flag_name, "1")
+        logger.debug("Добавлен флаг: %s", flag_name)
     
     async def _remove_flag(self, flag_name: str):
         """Удалить флаг"""
-        await FlagRepository.remove_flag(self.run_id, flag_name)
-        logger.debug(f"Удалён флаг: {flag_name}")
+        self._removes.add(flag_name)
+        self._writes.pop(flag_name, None)
+        self._flags_cache.pop(flag_name, None)
+        logger.debug("Удалён флаг: %s", flag_name)
     
     async def _set_flag(self, flag_value: Dict[str, str]):
         """
@@ -66,8 +111,8 @@ class EffectApplier:
         value = flag_value.get("value", "1")
         
         if flag_name:
-            await FlagRepository.set_flag(self.run_id, flag_name, str(value))
-            logger.debug(f"Установлен флаг: {flag_name} = {value}")
+            self._stage_write(flag_name, str(value))
+            logger.debug("Установлен флаг: %s = %s", flag_name, value)
     
     async def _increment_counter(self, counter_name: str):
         """
@@ -76,8 +121,30 @@ class EffectApplier:
         Args:
             counter_name: Имя счётчика (хранится как флаг)
         """
-        flags = await FlagRepository.get_flags(self.run_id)
-        current_value = int(flags.get(counter_name, "0"))
-        new_value = current_value + 1
-        await FlagRepository.set_flag(self.run_id, counter_name, str(new_value))
-        logger.debug(f"Увеличен счётчик: {counter_name} = {new_value}")
+        # Счётчик берём из разделяемого кэша; полный fetch - только если
+        # БД в этом process_choice ещё не читали. Истинность кэша как
+        # признак не годится: предыдущие эффекты выбора могли уже
+        # дописать флаги в пустой кэш (см. FlagsCache)
+        cache = self._flags_cache
+        if not cache.loaded:
+            # Значения, застейдженные эффектами этого выбора, новее БД;
+            # флаги, поставленные на удаление, не воскрешаем
+            for name, value in (await FlagRepository.get_flags(self.run_id)).items():
+                if name not in self._removes:
+                    cache.setdefault(name, value)
+            cache.loaded = True
+
+        new_value = int(cache.get(counter_name, "0")) + 1
+        self._stage_write(counter_name, str(new_value))
+        logger.debug("Увеличен счётчик: %s = %s", counter_name, new_value)
+    
+    # Таблица диспетчеризации эффектов: O(1) поиск вместо цепочки if/elif
+    _HANDLERS = {
+        "add_flag": _add_flag,
+        "remove_flag": _remove_flag,
+        "set_flag": _set_flag,
+        "increment_counter": _increment_counter,
+    }
+    
+    # Обработчики по числовому коду: доступ по индексу кортежа
+    _KIND_HANDLERS = (_add_flag, _remove_flag, _set_flag, _increment_counter)
@@ -1,54 +1,86 @@
 """
 Рендеринг сцен для Telegram
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import DEBUG
 from storage.repository import FlagRepository
 
+# Разделяемый пустой список для .get по choices: не аллоцируем
+# новый контейнер на каждый рендер (только чтение, без мутаций)
+_EMPTY_LIST: list = []
+
 class SceneRenderer:
     """Рендеринг сцен и выборов"""
     
     def __init__(self, run_id: int):
         self.run_id = run_id
     
-    async def render_scene(
+    async def _render_scene_debug(
         self, 
         scene: Dict[str, Any], 
         scene_id: str,
-        flags: Optional[Dict[str, str]] = None
+        flags: Optional[Dict[str, str]] = None,
+        button_specs: Optional[List[Tuple[str, str]]] = None
     ) -> tuple[str, InlineKeyboardMarkup]:
         """
-        Отрендерить сцену
+        Отрендерить сцену с debug-информацией (сцена, run_id, флаги)
         
         Args:
             scene: Данные сцены из YAML
             scene_id: ID сцены
             flags: Словарь флагов (опционально)
+            button_specs: Готовые пары (текст, шаблон callback_data)
+                из индекса движка (опционально)
         
         Returns:
             Кортеж (текст сообщения, клавиатура)
         """
         text = scene.get("text", "")
         
-        # Добавляем debug-информацию
-        if DEBUG:
-            debug_info = f"\n\n[DEBUG]\nСцена: {scene_id}\nRun ID: {self.run_id}"
-            
-            if flags is None:
-                flags = await FlagRepository.get_flags(self.run_id)
-            
-            if flags:
-                flags_str = ", ".join(f"{k}={v}" for k, v in flags.items())
-                debug_info += f"\nФлаги: {flags_str}"
-            
-            text += debug_info
+        debug_info = f"\n\n[DEBUG]\nСцена: {scene_id}\nRun ID: {self.run_id}"
+        
+        if flags is None:
+            flags = await FlagRepository.get_flags(self.run_id)
+        
+        if flags:
+            flags_str = ", ".join(f"{k}={v}" for k, v in flags.items())
+            debug_info += f"\nФлаги: {flags_str}"
+        
+        text += debug_info
         
         # Формируем клавиатуру с выбором
-        choices = scene.get("choices", [])
-        keyboard = self._build_keyboard(choices, scene_id)
+        if button_specs is not None:
+            keyboard = self._keyboard_from_specs(button_specs)
+        else:
+            keyboard = self._build_keyboard(scene.get("choices", _EMPTY_LIST), scene_id)
+
+        return text, keyboard
+
+    async def _render_scene_fast(
+        self, 
+        scene: Dict[str, Any], 
+        scene_id: str,
+        flags: Optional[Dict[str, str]] = None,
+        button_specs: Optional[List[Tuple[str, str]]] = None
+    ) -> tuple[str, InlineKeyboardMarkup]:
+        """
+        Отрендерить сцену (боевой вариант без debug-ветки)
+        
+        См. _render_scene_debug.
+        """
+        text = scene.get("text", "")
         
+        if button_specs is not None:
+            keyboard = self._keyboard_from_specs(button_specs)
+        else:
+            keyboard = self._build_keyboard(scene.get("choices", _EMPTY_LIST), scene_id)
+
         return text, keyboard
+
+    # Специализация при импорте: боевой путь не проверяет DEBUG
+    # и не тянет флаги из БД на каждый рендер
+    render_scene = _render_scene_debug if DEBUG else _render_scene_fast
     
     def _build_keyboard(
         self, 
@@ -80,6 +112,20 @@ class SceneRenderer:
         
         return InlineKeyboardMarkup(inline_keyboard=buttons)
     
+    def _keyboard_from_specs(self, button_specs: List[Tuple[str, str]]) -> InlineKeyboardMarkup:
+        """
+        Построить клавиатуру из готовых пар (текст, хвост callback_data)
+
+        Статическая часть подготовлена при загрузке истории,
+        здесь run_id подставляется простой конкатенацией.
+        """
+        head = f"choice:{self.run_id}"
+
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=text, callback_data=head + tail)]
+            for text, tail in button_specs
+        ])
+    
     def render_ending(
         self, 
         ending: Dict[str, Any], 
@@ -1,70 +1,417 @@
 """
 Движок истории - основная логика обработки сюжетов
 """
+import asyncio
+import copy
+import os
+import pickle
+import shutil
+import sys
 import yaml
-from typing import Dict, Any, Optional
+
+# C-ускоренный Loader из libyaml, с фолбэком на чистый Python
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 from pathlib import Path
-from config import STORIES_DIR
+from config import DEBUG, STORIES_DIR
 from storage.repository import RunRepository, FlagRepository
-from engine.conditions import ConditionChecker
-from engine.effects import EffectApplier
+from storage.models import Run
+from engine.conditions import ConditionChecker, FlagsCache, CONDITION_KINDS
+from engine.effects import EffectApplier, EFFECT_KINDS
 from engine.scene_renderer import SceneRenderer
 from utils.logger import logger
 
+# Разделяемые пустые значения по умолчанию для .get на горячих путях:
+# литерал [] / {} аллоцирует новый контейнер на каждый вызов.
+# По соглашению только читаются, никогда не мутируются.
+_EMPTY_LIST: list = []
+
+@dataclass(slots=True, frozen=True)
+class SceneView:
+    """
+    Неизменяемое представление сцены для горячего пути рендеринга
+
+    Доступ к слотам дешевле, чем dict.get по «сырой» сцене из YAML,
+    а неизменяемость защищает индекс от случайных мутаций.
+    """
+    text: str
+    button_specs: tuple
+
 class StoryEngine:
     """Движок для обработки историй"""
     
     def __init__(self):
         self.stories: Dict[str, Dict[str, Any]] = {}
+        # Read-only представление для list_stories: живёт поверх словаря,
+        # поэтому создаётся один раз и не требует копий
+        self._stories_view = MappingProxyType(self.stories)
+        # Индекс (story_id, scene_id) -> SceneView: текст и статическая
+        # часть кнопок готовятся при загрузке, в рендере остаётся
+        # подставить только run_id
+        self._scene_views: Dict[tuple[str, str], SceneView] = {}
+        # Индекс (story_id, scene_id, choice_id) -> (условия, эффекты)
+        # в виде кортежей (код, аргумент) вместо словарей на каждый элемент
+        self._choice_programs: Dict[tuple[str, str, str], tuple] = {}
+        # Индекс (story_id, scene_id, choice_id) -> словарь выбора:
+        # O(1) вместо линейного перебора choices на каждый клик
+        self._choice_index: Dict[tuple[str, str, str], Dict[str, Any]] = {}
+        # Плоские индексы (story_id, scene_id) -> сцена/финал:
+        # один поиск по хэшу вместо двухуровневого stories[...][...]
+        self._scene_index: Dict[tuple[str, str], Dict[str, Any]] = {}
+        self._ending_index: Dict[tuple[str, str], Dict[str, Any]] = {}
+        # Готовые части текста /list (строятся лениво, сбрасываются при изменениях)
+        self._list_chunks: Optional[List[str]] = None
+        # Версия набора историй: растёт при каждом изменении, чтобы
+        # внешние кэши (например, клавиатуры списка) могли сбрасываться
+        self.stories_version = 0
         self._load_stories()
     
     def _load_stories(self):
         """Загрузить все истории из директории stories"""
+        self._apply_parsed(self._parse_all())
+
+    def _parse_all(self) -> List:
+        """
+        Распарсить все файлы историй (блокирующая фаза без мутаций)
+
+        Не трогает состояние движка, поэтому может выполняться
+        в рабочем потоке, пока обработчики продолжают читать старые
+        индексы.
+        """
         stories_path = Path(STORIES_DIR)
-        
+
         if not stories_path.exists():
-            logger.warning(f"Директория историй не найдена: {STORIES_DIR}")
-            return
-        
-        # Загружаем .yaml и .yml файлы
-        yaml_files = list(stories_path.glob("*.yaml")) + list(stories_path.glob("*.yml"))
-        
-        for yaml_file in yaml_files:
+            logger.warning("Директория историй не найдена: %s", STORIES_DIR)
+            return []
+
+        # Загружаем .yaml и .yml файлы: один проход scandir вместо
+        # двух обходов каталога glob-ом
+        with os.scandir(stories_path) as it:
+            yaml_files = [
+                Path(entry.path)
+                for entry in it
+                if entry.is_file() and entry.name.endswith((".yaml", ".yml"))
+            ]
+
+        # Файлы парсятся параллельно: libyaml отпускает GIL во время
+        # C-парсинга, поэтому потоки реально работают одновременно.
+        # Словарь stories наполняется только в основном потоке.
+        if len(yaml_files) > 1:
+            with ThreadPoolExecutor(max_workers=min(8, len(yaml_files))) as pool:
+                return list(pool.map(self._parse_one, yaml_files))
+
+        return [self._parse_one(yaml_file) for yaml_file in yaml_files]
+
+    def _apply_parsed(self, results: List):
+        """Наполнить stories и индексы результатами парсинга"""
+        loaded = 0
+        for entry in results:
+            if entry is None:
+                continue
+            
+            yaml_file, story_data = entry
+            
+            if not story_data:
+                logger.warning("Пустой файл истории: %s", yaml_file)
+                continue
+            
+            story_id = story_data.get("id")
+            if not story_id:
+                logger.warning("История без ID: %s", yaml_file)
+                continue
+
+            # Интернированный ID сравнивается по указателю при поиске
+            # в индексах (Run интернирует свои поля симметрично)
+            story_id = sys.intern(story_id)
+            self.stories[story_id] = story_data
+            
+            self._index_scenes(story_id, story_data)
+            loaded += 1
+
+            # Пофайловый лог только в debug, общий итог — одной строкой ниже
+            logger.debug("Загружена история: %s (%s)", story_id, yaml_file.name)
+
+        if loaded:
+            logger.info("Загружено историй: %d", loaded)
+    
+    @classmethod
+    def _parse_one(cls, yaml_file: Path):
+        """Распарсить один файл в потоке пула; ошибки не роняют всю загрузку"""
+        try:
+            return yaml_file, cls._parse_story_file(yaml_file)
+        except yaml.YAMLError as e:
+            logger.error("Ошибка парсинга YAML %s: %s", yaml_file, e)
+        except Exception as e:
+            logger.error("Ошибка загрузки истории %s: %s", yaml_file, e)
+        return None
+    
+    @staticmethod
+    def _parse_story_file(yaml_file: Path) -> Optional[Dict[str, Any]]:
+        """
+        Распарсить файл истории с pickle-кэшем по mtime и размеру
+
+        Загрузка pickle на порядок дешевле парсинга YAML, поэтому
+        повторные старты платят только за os.stat на файл.
+        """
+        st = yaml_file.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        cache_file = yaml_file.parent / ".cache" / (yaml_file.name + ".pkl")
+        
+        try:
+            with open(cache_file, "rb") as f:
+                cached_stamp, story_data = pickle.load(f)
+            if cached_stamp == stamp:
+                return story_data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug("Кэш истории не прочитан (%s): %s", cache_file.name, e)
+        
+        # Бинарный режим: libyaml декодирует utf-8 сам,
+        # без лишнего прохода на уровне Python
+        with open(yaml_file, "rb") as f:
+            story_data = yaml.load(f, Loader=SafeLoader)
+        
+        if story_data:
             try:
-                with open(yaml_file, "r", encoding="utf-8") as f:
-                    story_data = yaml.safe_load(f)
-                    
-                    if not story_data:
-                        logger.warning(f"Пустой файл истории: {yaml_file}")
-                        continue
-                    
-                    story_id = story_data.get("id")
-                    if not story_id:
-                        logger.warning(f"История без ID: {yaml_file}")
-                        continue
-                    
-                    self.stories[story_id] = story_data
-                    logger.info(f"Загружена история: {story_id} ({yaml_file.name})")
+                cache_file.parent.mkdir(exist_ok=True)
+                tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+                with open(tmp_file, "wb") as f:
+                    pickle.dump((stamp, story_data), f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_file, cache_file)
+            except OSError as e:
+                logger.debug("Кэш истории не записан (%s): %s", cache_file.name, e)
+        
+        return story_data
+    
+    def _index_scenes(self, story_id: str, story_data: Dict[str, Any]):
+        """Построить индексы сцен и программ выборов для истории"""
+        for ending_id, ending in story_data.get("endings", {}).items():
+            self._ending_index[(story_id, sys.intern(ending_id))] = ending
+
+        for scene_id, scene in story_data.get("scenes", {}).items():
+            scene_id = sys.intern(scene_id)
+            self._scene_index[(story_id, scene_id)] = scene
+            # В callback_data переменная только run_id, поэтому
+            # в спецификации хранится готовый хвост ":scene:choice" -
+            # рендер обходится конкатенацией вместо str.format
+            self._scene_views[(story_id, scene_id)] = SceneView(
+                text=scene.get("text", ""),
+                button_specs=tuple(
+                    (
+                        choice.get("text", ""),
+                        f":{scene_id}:{choice.get('id', '')}",
+                    )
+                    for choice in scene.get("choices", [])
+                ),
+            )
             
-            except yaml.YAMLError as e:
-                logger.error(f"Ошибка парсинга YAML {yaml_file}: {e}")
-            except Exception as e:
-                logger.error(f"Ошибка загрузки истории {yaml_file}: {e}")
+            for choice in scene.get("choices", []):
+                # setdefault: при дубликатах ID побеждает первый выбор,
+                # как и при прежнем линейном поиске
+                self._choice_index.setdefault(
+                    (story_id, scene_id, choice.get("id", "")), choice
+                )
+
+                program = self._compile_choice(choice)
+                if program is not None:
+                    self._choice_programs[(story_id, scene_id, choice.get("id", ""))] = program
+    
+    @staticmethod
+    def _compile_choice(choice: Dict[str, Any]) -> Optional[tuple]:
+        """
+        Скомпилировать условия и эффекты выбора в кортежи (код, аргумент)
+
+        Returns:
+            Кортеж (условия, эффекты) или None, если встретился
+            неизвестный тип - такой выбор обрабатывается по словарям
+            со штатными предупреждениями
+        """
+        conditions = []
+        for condition in choice.get("conditions", []):
+            kind_name = next(iter(condition))
+            kind = CONDITION_KINDS.get(kind_name)
+            if kind is None:
+                return None
+            conditions.append((kind, condition[kind_name]))
+        
+        effects = []
+        for effect in choice.get("effects", []):
+            kind_name = next(iter(effect))
+            kind = EFFECT_KINDS.get(kind_name)
+            if kind is None:
+                return None
+            effects.append((kind, effect[kind_name]))
+        
+        return tuple(conditions), tuple(effects)
     
     def get_story(self, story_id: str) -> Optional[Dict[str, Any]]:
         """Получить историю по ID"""
         return self.stories.get(story_id)
     
-    def list_stories(self) -> Dict[str, Dict[str, Any]]:
-        """Получить список всех историй"""
-        return self.stories.copy()
+    def list_stories(self) -> Mapping[str, Dict[str, Any]]:
+        """
+        Получить список всех историй
+
+        Возвращается read-only представление словаря без копирования:
+        вызывающие только читают список, а копия на каждый показ меню
+        была бы лишней аллокацией.
+        """
+        return self._stories_view
     
+    def get_stories(self, story_ids) -> Dict[str, Dict[str, Any]]:
+        """
+        Получить несколько историй одним вызовом
+
+        Args:
+            story_ids: Итерируемое с ID историй
+
+        Returns:
+            Словарь story_id -> данные истории (без отсутствующих)
+        """
+        stories = self.stories
+        return {
+            story_id: story
+            for story_id in story_ids
+            if (story := stories.get(story_id)) is not None
+        }
+
+    def get_story_with_path(self, story_id: str) -> Tuple[Optional[Dict[str, Any]], Path]:
+        """
+        Получить копию истории для редактирования и путь к её файлу
+
+        Редакторы мутируют копию и возвращают её через update_story,
+        не перечитывая YAML с диска.
+
+        Args:
+            story_id: ID истории
+
+        Returns:
+            Кортеж (deepcopy данных истории или None, путь к файлу)
+        """
+        story = self.stories.get(story_id)
+        file_path = Path(STORIES_DIR) / f"{story_id}.yaml"
+        return (copy.deepcopy(story) if story else None), file_path
+
+    def update_story(self, story_id: str, story_data: Dict[str, Any]):
+        """
+        Обновить одну историю в кэше без полной перезагрузки
+
+        Args:
+            story_id: ID истории
+            story_data: Новые данные истории
+        """
+        story_id = sys.intern(story_id)
+        self.stories[story_id] = story_data
+
+        # Пересобираем индексы только для этой истории
+        for index in (
+            self._scene_views,
+            self._choice_programs,
+            self._choice_index,
+            self._scene_index,
+            self._ending_index,
+        ):
+            stale_keys = [key for key in index if key[0] == story_id]
+            for key in stale_keys:
+                del index[key]
+
+        self._index_scenes(story_id, story_data)
+
+        self._list_chunks = None
+        self.stories_version += 1
+        logger.info("История обновлена в кэше: %s", story_id)
+
     def reload_stories(self):
-        """Перезагрузить все истории из файлов"""
+        """Перезагрузить все истории из файлов (кэш парсинга сбрасывается)"""
+        self._replace_all(self._reparse_from_disk())
+
+    async def reload_stories_async(self):
+        """
+        Перезагрузить истории, не блокируя event loop
+
+        Парсинг (включая дисковый ввод-вывод) уходит в рабочий поток
+        через asyncio.to_thread; старые индексы подменяются готовыми
+        результатами уже в цикле событий, поэтому обработчики ни в один
+        момент не видят полупустого состояния.
+        """
+        results = await asyncio.to_thread(self._reparse_from_disk)
+        self._replace_all(results)
+
+    def _reparse_from_disk(self) -> List:
+        """Сбросить кэш парсинга и распарсить все файлы заново"""
+        shutil.rmtree(Path(STORIES_DIR) / ".cache", ignore_errors=True)
+        return self._parse_all()
+
+    def _replace_all(self, results: List):
+        """Заменить все истории и индексы результатами парсинга"""
         self.stories.clear()
-        self._load_stories()
+        self._scene_views.clear()
+        self._choice_programs.clear()
+        self._choice_index.clear()
+        self._scene_index.clear()
+        self._ending_index.clear()
+        self._list_chunks = None
+        self.stories_version += 1
+        self._apply_parsed(results)
         logger.info("Истории перезагружены")
     
+    def get_list_chunks(self) -> List[str]:
+        """
+        Получить готовый текст списка историй частями по лимиту Telegram
+
+        Текст форматируется один раз и кэшируется до изменения историй,
+        так что повторные /list не платят за форматирование.
+
+        Returns:
+            Список частей текста (пустой, если историй нет)
+        """
+        if self._list_chunks is None:
+            self._list_chunks = self._build_list_chunks()
+        
+        return self._list_chunks
+    
+    def _build_list_chunks(self) -> List[str]:
+        """Собрать текст списка историй частями по границам записей"""
+        if not self.stories:
+            return []
+        
+        # Части режем по целым записям, а не по срезу на 4096-м символе
+        # (оставляем запас до лимита Telegram)
+        max_chunk = 4000
+        chunks: List[str] = []
+        buf = ["📚 Доступные истории:\n"]
+        size = len(buf[0])
+        
+        for story_id, story_data in self.stories.items():
+            title = story_data.get("title", story_id)
+            description = story_data.get("description", "")
+            version = story_data.get("version", "1.0")
+            
+            entry = f"\n• {title}\n  ID: {story_id}\n"
+            if description:
+                entry += f"  {description}\n"
+            entry += f"  Версия: {version}\n"
+            
+            if size + len(entry) > max_chunk and buf:
+                chunks.append("".join(buf))
+                buf = []
+                size = 0
+            
+            buf.append(entry)
+            size += len(entry)
+        
+        if buf:
+            chunks.append("".join(buf))
+        
+        return chunks
+
     async def start_story(self, user_id: int, story_id: str) -> Optional[tuple[str, Any, int]]:
         """
         Начать историю
@@ -78,13 +425,13 @@ class StoryEngine:
         """
         story = self.get_story(story_id)
         if not story:
-            logger.warning(f"История не найдена: {story_id}")
+            logger.warning("История не найдена: %s", story_id)
             return None
         
         # Проверяем, есть ли активная попытка
         active_run = await RunRepository.get_active_run(user_id, story_id)
         if active_run:
-            logger.info(f"У пользователя {user_id} уже есть активная попытка истории {story_id}")
+            logger.info("У пользователя %s уже есть активная попытка истории %s", user_id, story_id)
             return await self.continue_story(active_run.run_id)
         
         # Проверяем возможность перезапуска
@@ -92,12 +439,12 @@ class StoryEngine:
         if not allow_restart:
             # Проверяем, была ли завершённая попытка
             # (это упрощённая проверка, можно расширить)
-            logger.info(f"История {story_id} не позволяет перезапуск")
+            logger.info("История %s не позволяет перезапуск", story_id)
         
         # Начинаем новую попытку
         start_scene = story.get("start_scene")
         if not start_scene:
-            logger.error(f"История {story_id} не имеет start_scene")
+            logger.error("История %s не имеет start_scene", story_id)
             return None
         
         run = await RunRepository.create(user_id, story_id, start_scene)
@@ -117,65 +464,83 @@ class StoryEngine:
         # Получаем данные попытки
         run = await RunRepository._get_run_by_id(run_id)
         if not run:
-            logger.error(f"Попытка прохождения не найдена: {run_id}")
+            logger.error("Попытка прохождения не найдена: %s", run_id)
             return None
         
         story = self.get_story(run.story_id)
         if not story:
-            logger.error(f"История не найдена: {run.story_id}")
+            logger.error("История не найдена: %s", run.story_id)
             return None
-        
+
+        return await self._render_current(run)
+
+    async def _render_current(self, run: Run) -> Optional[tuple[str, Any, int]]:
+        """
+        Отрендерить текущую сцену (или финал) уже загруженной попытки
+
+        Вынесено из continue_story, чтобы process_choice мог рендерить
+        без повторного SELECT попытки из БД. Сцена и финал берутся из
+        плоских индексов по ключу (story_id, scene_id).
+
+        Args:
+            run: Загруженная попытка прохождения
+
+        Returns:
+            Кортеж (текст, клавиатура, run_id) или None если ошибка
+        """
         scene_id = run.current_scene
-        
+
         # Проверяем, это финал?
-        endings = story.get("endings", {})
-        if scene_id in endings:
-            return await self._render_ending(run_id, story, scene_id)
-        
+        ending = self._ending_index.get((run.story_id, scene_id))
+        if ending is not None:
+            return await self._render_ending(run.run_id, ending, scene_id)
+
         # Проверяем, это сцена?
-        scenes = story.get("scenes", {})
-        if scene_id not in scenes:
-            logger.error(f"Сцена не найдена: {scene_id} в истории {run.story_id}")
+        scene = self._scene_index.get((run.story_id, scene_id))
+        if scene is None:
+            logger.error("Сцена не найдена: %s в истории %s", scene_id, run.story_id)
             return None
-        
-        scene = scenes[scene_id]
-        renderer = SceneRenderer(run_id)
-        flags = await FlagRepository.get_flags(run_id)
-        
-        text, keyboard = await renderer.render_scene(scene, scene_id, flags)
-        
-        return text, keyboard, run_id
-    
+
+        renderer = SceneRenderer(run.run_id)
+        # Флаги нужны только debug-рендеру; боевой путь не тратит
+        # обращение к БД на данные, которые не попадут в сообщение
+        flags = await FlagRepository.get_flags(run.run_id) if DEBUG else None
+
+        view = self._scene_views.get((run.story_id, scene_id))
+        text, keyboard = await renderer.render_scene(
+            scene, scene_id, flags,
+            button_specs=view.button_specs if view else None
+        )
+
+        return text, keyboard, run.run_id
+
     async def _render_ending(
-        self, 
-        run_id: int, 
-        story: Dict[str, Any], 
+        self,
+        run_id: int,
+        ending: Dict[str, Any],
         ending_id: str
     ) -> tuple[str, Any, int]:
         """
         Отрендерить финал
-        
+
         Args:
             run_id: ID попытки прохождения
-            story: Данные истории
+            ending: Данные финала из индекса
             ending_id: ID финала
-        
+
         Returns:
             Кортеж (текст, None (нет клавиатуры), run_id)
         """
-        endings = story.get("endings", {})
-        ending = endings.get(ending_id)
-        
         if not ending:
-            logger.error(f"Финал не найден: {ending_id}")
+            logger.error("Финал не найден: %s", ending_id)
             return "Ошибка: финал не найден", None, run_id
-        
+
         # Завершаем попытку
         await RunRepository.finish_run(run_id)
         
         renderer = SceneRenderer(run_id)
-        flags = await FlagRepository.get_flags(run_id)
-        
+        flags = await FlagRepository.get_flags(run_id) if DEBUG else None
+
         text = renderer.render_ending(ending, ending_id, flags)
         
         return text, None, run_id
@@ -195,56 +560,72 @@ class StoryEngine:
             choice_id: ID выбранного выбора
         
         Returns:
-            Кортеж (текст, клавиатура, run_id) или None если ошибка
+            Кортеж (текст, клавиатура, run_id, обновлённый Run) или None если ошибка
         """
         # Получаем данные попытки
         run = await RunRepository._get_run_by_id(run_id)
         if not run:
-            logger.error(f"Попытка прохождения не найдена: {run_id}")
+            logger.error("Попытка прохождения не найдена: %s", run_id)
             return None
         
         story = self.get_story(run.story_id)
         if not story:
-            logger.error(f"История не найдена: {run.story_id}")
+            logger.error("История не найдена: %s", run.story_id)
             return None
         
-        scenes = story.get("scenes", {})
-        scene = scenes.get(scene_id)
-        
-        if not scene:
-            logger.error(f"Сцена не найдена: {scene_id}")
+        choice = self._choice_index.get((run.story_id, scene_id, choice_id))
+
+        if not choice:
+            if (run.story_id, scene_id) not in self._scene_index:
+                logger.error("Сцена не найдена: %s", scene_id)
+            else:
+                logger.error("Выбор не найден: %s в сцене %s", choice_id, scene_id)
             return None
         
-        choices = scene.get("choices", [])
-        choice = next((c for c in choices if c.get("id") == choice_id), None)
+        # Проверяем условия; кэш флагов разделяется с эффектами,
+        # чтобы не ходить в БД за одними и теми же флагами дважды
+        flags_cache = FlagsCache()
+        checker = ConditionChecker(run_id, flags_cache)
+        applier = EffectApplier(run_id, flags_cache)
         
-        if not choice:
-            logger.error(f"Выбор не найден: {choice_id} в сцене {scene_id}")
-            return None
+        # Скомпилированная программа выбора (если все типы известны)
+        program = self._choice_programs.get((run.story_id, scene_id, choice_id))
         
-        # Проверяем условия
-        conditions = choice.get("conditions", [])
-        checker = ConditionChecker(run_id)
+        if program is not None:
+            passed = await checker.check_compiled(program[0])
+        else:
+            passed = await checker.check_conditions(choice.get("conditions", _EMPTY_LIST))
         
-        if not await checker.check_conditions(conditions):
-            logger.debug(f"Условия не выполнены для выбора {choice_id}")
+        if not passed:
+            logger.debug("Условия не выполнены для выбора %s", choice_id)
             return None
         
         # Применяем эффекты
-        effects = choice.get("effects", [])
-        applier = EffectApplier(run_id)
-        await applier.apply_effects(effects)
+        if program is not None:
+            await applier.apply_compiled(program[1])
+        else:
+            await applier.apply_effects(choice.get("effects", _EMPTY_LIST))
         
         # Переходим на следующую сцену
         next_scene = choice.get("next_scene")
         if not next_scene:
-            logger.error(f"Выбор {choice_id} не имеет next_scene")
+            logger.error("Выбор %s не имеет next_scene", choice_id)
             return None
         
+        # Отражаем переход в уже загруженном Run и рендерим напрямую,
+        # не перечитывая попытку из БД через continue_story
+        run.current_scene = next_scene
         await RunRepository.update_scene(run_id, next_scene)
-        
-        # Продолжаем историю
-        return await self.continue_story(run_id)
+
+        result = await self._render_current(run)
+        if result is None:
+            return None
+
+        text, keyboard, run_id = result
+
+        run.is_finished = (run.story_id, next_scene) in self._ending_index
+
+        return text, keyboard, run_id, run
     
     def preview_scene(self, story_id: str, scene_id: str) -> Optional[str]:
         """
@@ -257,15 +638,6 @@ class StoryEngine:
         Returns:
             Текст сцены или None
         """
-        story = self.get_story(story_id)
-        if not story:
-            return None
-        
-        scenes = story.get("scenes", {})
-        scene = scenes.get(scene_id)
-        
-        if not scene:
-            return None
-        
-        return scene.get("text", "")
+        view = self._scene_views.get((story_id, scene_id))
+        return view.text if view else None
 
@@ -1,6 +1,9 @@
 """
 Обработчики главного меню и выбора историй
 """
+import asyncio
+import functools
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command, StateFilter
@@ -11,21 +14,59 @@ from utils.logger import logger
 
 router = Router(name="menu")
 
+# Статические клавиатуры собираются один раз при импорте:
+# их состав не зависит ни от пользователя, ни от набора историй
+MAIN_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📚 Истории")],
+        [KeyboardButton(text="🧭 Продолжить"), KeyboardButton(text="🔄 Новая попытка")],
+        [KeyboardButton(text="ℹ️ Помощь")]
+    ],
+    resize_keyboard=True
+)
+
+BACK_TO_STORIES_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")]
+])
+
+BACK_TO_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=BACK_TO_MENU, callback_data="service_menu")]
+])
+
+STORIES_LIST_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📚 Истории", callback_data="show_stories:0")]
+])
+
+ALREADY_FINISHED_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")],
+    [InlineKeyboardButton(text=BACK_TO_MENU, callback_data="service_menu")]
+])
+
+RESET_CANCEL_BUTTON = InlineKeyboardButton(text="❌ Отменить", callback_data="reset_cancel")
+
 # Главная клавиатура
 def get_main_keyboard() -> ReplyKeyboardMarkup:
-    """Создать главную клавиатуру"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📚 Истории")],
-            [KeyboardButton(text="🧭 Продолжить"), KeyboardButton(text="🔄 Новая попытка")],
-            [KeyboardButton(text="ℹ️ Помощь")]
-        ],
-        resize_keyboard=True
-    )
-    return keyboard
+    """Получить главную клавиатуру (готовый singleton)"""
+    return MAIN_KEYBOARD
+
+# Кэш готовых клавиатур списка: ключ (page, per_page).
+# Список историй меняется редко, а клавиатура запрашивается на каждый
+# показ списка, поэтому разметка строится один раз на версию набора историй.
+_stories_kb_cache: dict = {}
+_stories_kb_version = -1
 
 def get_stories_inline_keyboard(page: int = 0, per_page: int = 10) -> tuple[InlineKeyboardMarkup, int]:
     """Создать inline-клавиатуру со списком историй с пагинацией"""
+    global _stories_kb_version
+
+    if _stories_kb_version != story_engine.stories_version:
+        _stories_kb_cache.clear()
+        _stories_kb_version = story_engine.stories_version
+
+    cached = _stories_kb_cache.get((page, per_page))
+    if cached is not None:
+        return cached
+
     stories = story_engine.list_stories()
     story_list = list(stories.items())
     total_pages = (len(story_list) + per_page - 1) // per_page
@@ -66,10 +107,18 @@ def get_stories_inline_keyboard(page: int = 0, per_page: int = 10) -> tuple[Inli
         if nav_buttons:
             buttons.append(nav_buttons)
     
-    return InlineKeyboardMarkup(inline_keyboard=buttons), total_pages
+    result = InlineKeyboardMarkup(inline_keyboard=buttons), total_pages
+    _stories_kb_cache[(page, per_page)] = result
+    return result
+
+@functools.lru_cache(maxsize=256)
+def get_story_card_keyboard(story_id: str, has_active_run: bool, allow_restart: bool) -> InlineKeyboardMarkup:
+    """
+    Создать клавиатуру для карточки истории
 
-def get_story_card_keyboard(story_id: str, user_id: int, has_active_run: bool, allow_restart: bool) -> InlineKeyboardMarkup:
-    """Создать клавиатуру для карточки истории"""
+    Клавиатура зависит только от трёх аргументов (user_id в callback_data
+    не участвует), поэтому результат кэшируется через lru_cache.
+    """
     buttons = []
     
     if has_active_run:
@@ -105,9 +154,8 @@ async def cmd_start(message: Message):
     )
     
     # Проверяем активную историю
-    all_runs = await RunRepository.get_all_active_runs()
-    user_runs = [r for r in all_runs if r.user_id == user.user_id]
-    
+    user_runs = await RunRepository.get_active_run_refs(user.user_id)
+
     if user_runs:
         welcome = WELCOME_WITH_ACTIVE
     else:
@@ -124,12 +172,9 @@ async def show_stories(message: Message):
     stories = story_engine.list_stories()
     
     if not stories:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=BACK_TO_MENU, callback_data="service_menu")]
-        ])
         await message.answer(
             NO_STORIES_TEXT,
-            reply_markup=keyboard
+            reply_markup=BACK_TO_MENU_KEYBOARD
         )
         return
     
@@ -141,20 +186,19 @@ async def continue_story(message: Message):
     """Продолжить активную историю"""
     user_id = message.from_user.id
     
-    all_runs = await RunRepository.get_all_active_runs()
-    user_runs = [r for r in all_runs if r.user_id == user_id]
-    
+    user_runs = await RunRepository.get_active_run_refs(user_id)
+
     if not user_runs:
         await message.answer(
             NO_ACTIVE_STORY,
             reply_markup=get_main_keyboard()
         )
         return
-    
+
     # Берём последнюю активную попытку
-    run = user_runs[-1]
-    
-    result = await story_engine.continue_story(run.run_id)
+    run_id, _ = user_runs[-1]
+
+    result = await story_engine.continue_story(run_id)
     if result:
         text, keyboard, run_id = result
         
@@ -170,49 +214,48 @@ async def new_attempt(message: Message):
     """Новая попытка с подтверждением"""
     user_id = message.from_user.id
     
-    all_runs = await RunRepository.get_all_active_runs()
-    user_runs = [r for r in all_runs if r.user_id == user_id]
-    
+    user_runs = await RunRepository.get_active_run_refs(user_id)
+
     if not user_runs:
         await message.answer(
             NOTHING_TO_RESET,
             reply_markup=get_main_keyboard()
         )
         return
-    
+
     # Если одна активная история - сразу подтверждение
     if len(user_runs) == 1:
-        run = user_runs[0]
-        story = story_engine.get_story(run.story_id)
-        title = story.get("title", run.story_id) if story else run.story_id
-        
+        _, story_id = user_runs[0]
+        story = story_engine.get_story(story_id)
+        title = story.get("title", story_id) if story else story_id
+
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Да", callback_data=f"reset_confirm:{run.story_id}"),
+                InlineKeyboardButton(text="✅ Да", callback_data=f"reset_confirm:{story_id}"),
                 InlineKeyboardButton(text="❌ Нет", callback_data="reset_cancel")
             ]
         ])
-        
+
         await message.answer(
             f"{CONFIRM_RESET}\n\nИстория: {title}",
             reply_markup=keyboard
         )
     else:
         # Несколько активных историй - выбор
+        # Истории разрешаем одним вызовом, а не по одной на попытку
+        stories = story_engine.get_stories({story_id for _, story_id in user_runs})
         buttons = []
-        for run in user_runs:
-            story = story_engine.get_story(run.story_id)
-            title = story.get("title", run.story_id) if story else run.story_id
+        for _, story_id in user_runs:
+            story = stories.get(story_id)
+            title = story.get("title", story_id) if story else story_id
             buttons.append([
                 InlineKeyboardButton(
                     text=f"🔄 {title}",
-                    callback_data=f"reset_select:{run.story_id}"
+                    callback_data=f"reset_select:{story_id}"
                 )
             ])
         
-        buttons.append([
-            InlineKeyboardButton(text="❌ Отменить", callback_data="reset_cancel")
-        ])
+        buttons.append([RESET_CANCEL_BUTTON])
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
         await message.answer("🔄 Выбери историю для сброса:", reply_markup=keyboard)
@@ -220,30 +263,28 @@ async def new_attempt(message: Message):
 @router.message(F.text == "ℹ️ Помощь")
 async def show_help(message: Message):
     """Показать справку"""
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📚 Истории", callback_data="show_stories:0")]
-    ])
-    
-    await message.answer(HELP_TEXT, reply_markup=keyboard)
+    await message.answer(HELP_TEXT, reply_markup=STORIES_LIST_KEYBOARD)
 
-# Callback handlers
-@router.callback_query(F.data.startswith("story_page:"))
-async def change_story_page(callback: CallbackQuery):
+# Callback handlers (регистрируются через таблицу диспетчеризации в конце модуля)
+# edit_text и answer - независимые запросы к Telegram API, поэтому там,
+# где текст ack не зависит от результата, они отправляются конкурентно
+# через asyncio.gather: спиннер гаснет, не дожидаясь edit_text
+async def change_story_page(callback: CallbackQuery, arg: str):
     """Смена страницы списка историй"""
-    page = int(callback.data.split(":")[1])
+    page = int(arg)
     keyboard, _ = get_stories_inline_keyboard(page=page)
-    await callback.message.edit_text(STORIES_LIST_TEXT, reply_markup=keyboard)
-    await callback.answer()
+    await asyncio.gather(
+        callback.message.edit_text(STORIES_LIST_TEXT, reply_markup=keyboard),
+        callback.answer()
+    )
 
-@router.callback_query(F.data == "story_page_info")
-async def story_page_info(callback: CallbackQuery):
+async def story_page_info(callback: CallbackQuery, arg: str):
     """Информация о странице (неактивная кнопка)"""
     await callback.answer()
 
-@router.callback_query(F.data.startswith("story_select:"))
-async def process_story_selection(callback: CallbackQuery):
+async def process_story_selection(callback: CallbackQuery, arg: str):
     """Обработка выбора истории - показать карточку"""
-    story_id = callback.data.split(":", 1)[1]
+    story_id = arg
     user_id = callback.from_user.id
     
     story = story_engine.get_story(story_id)
@@ -269,57 +310,45 @@ async def process_story_selection(callback: CallbackQuery):
     
     card_text = get_story_card(title, description, version)
     
-    keyboard = get_story_card_keyboard(story_id, user_id, has_active_run, allow_restart)
-    
-    await callback.message.edit_text(card_text, reply_markup=keyboard)
-    await callback.answer()
+    keyboard = get_story_card_keyboard(story_id, has_active_run, allow_restart)
 
-@router.callback_query(F.data.startswith("story_start:"))
-async def start_story(callback: CallbackQuery):
+    await asyncio.gather(
+        callback.message.edit_text(card_text, reply_markup=keyboard),
+        callback.answer()
+    )
+
+async def start_story(callback: CallbackQuery, arg: str):
     """Запуск истории"""
     try:
-        story_id = callback.data.split(":", 1)[1]
+        story_id = arg
         user_id = callback.from_user.id
-        
-        await UserRepository.get_or_create(user_id, callback.from_user.username)
-        
+
+        # Регистрация пользователя и проверка завершённых попыток
+        # не зависят друг от друга - выполняем конкурентно
+        _, has_finished = await asyncio.gather(
+            UserRepository.get_or_create(user_id, callback.from_user.username),
+            RunRepository.has_finished_run(user_id, story_id),
+        )
+
         story = story_engine.get_story(story_id)
         if not story:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")]
-            ])
             await callback.message.edit_text(
                 STORY_NOT_FOUND,
-                reply_markup=keyboard
+                reply_markup=BACK_TO_STORIES_KEYBOARD
             )
             await callback.answer("❌ История не найдена", show_alert=True)
             return
-        
-        # Проверяем завершённые попытки
-        from storage.db import db
-        has_finished = False
-        if db.connection:
-            async with db.connection.execute(
-                """SELECT 1 FROM runs 
-                   WHERE user_id = ? AND story_id = ? AND is_finished = 1
-                   LIMIT 1""",
-                (user_id, story_id)
-            ) as cursor:
-                row = await cursor.fetchone()
-                has_finished = row is not None
-        
+
         allow_restart = story.get("allow_restart", False)
         
         if has_finished and not allow_restart:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")],
-                [InlineKeyboardButton(text=BACK_TO_MENU, callback_data="service_menu")]
-            ])
-            await callback.message.edit_text(
-                STORY_ALREADY_FINISHED,
-                reply_markup=keyboard
+            await asyncio.gather(
+                callback.message.edit_text(
+                    STORY_ALREADY_FINISHED,
+                    reply_markup=ALREADY_FINISHED_KEYBOARD
+                ),
+                callback.answer()
             )
-            await callback.answer()
             return
         
         # Сбрасываем предыдущую попытку, если есть
@@ -329,12 +358,9 @@ async def start_story(callback: CallbackQuery):
         result = await story_engine.start_story(user_id, story_id)
         
         if result is None:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")]
-            ])
             await callback.message.edit_text(
                 ERROR_LOADING_STORY,
-                reply_markup=keyboard
+                reply_markup=BACK_TO_STORIES_KEYBOARD
             )
             await callback.answer("❌ Ошибка запуска", show_alert=True)
             return
@@ -342,23 +368,21 @@ async def start_story(callback: CallbackQuery):
         text, keyboard, run_id = result
         
         # Сервисные кнопки убраны - навигация только через ReplyKeyboard
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer()
+        await asyncio.gather(
+            callback.message.edit_text(text, reply_markup=keyboard),
+            callback.answer()
+        )
     except Exception as e:
-        logger.error(f"Ошибка при запуске истории: {e}", exc_info=True)
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=BACK_TO_STORIES, callback_data="show_stories:0")]
-        ])
+        logger.error("Ошибка при запуске истории: %s", e, exc_info=True)
         await callback.message.edit_text(
             ERROR_LOADING_STORY,
-            reply_markup=keyboard
+            reply_markup=BACK_TO_STORIES_KEYBOARD
         )
         await callback.answer("❌ Ошибка", show_alert=True)
 
-@router.callback_query(F.data.startswith("story_continue:"))
-async def continue_story_callback(callback: CallbackQuery):
+async def continue_story_callback(callback: CallbackQuery, arg: str):
     """Продолжить историю из карточки"""
-    story_id = callback.data.split(":", 1)[1]
+    story_id = arg
     user_id = callback.from_user.id
     
     active_run = await RunRepository.get_active_run(user_id, story_id)
@@ -369,54 +393,58 @@ async def continue_story_callback(callback: CallbackQuery):
     result = await story_engine.continue_story(active_run.run_id)
     if result:
         text, keyboard, run_id = result
-        
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer()
+
+        await asyncio.gather(
+            callback.message.edit_text(text, reply_markup=keyboard),
+            callback.answer()
+        )
     else:
         await callback.answer("❌ Ошибка", show_alert=True)
 
-@router.callback_query(F.data.startswith("show_stories:"))
-async def show_stories_callback(callback: CallbackQuery):
+async def show_stories_callback(callback: CallbackQuery, arg: str):
     """Показать список историй через callback"""
-    page = int(callback.data.split(":")[1]) if ":" in callback.data else 0
+    page = int(arg) if arg else 0
     keyboard, _ = get_stories_inline_keyboard(page=page)
-    await callback.message.edit_text(STORIES_LIST_TEXT, reply_markup=keyboard)
-    await callback.answer()
+    await asyncio.gather(
+        callback.message.edit_text(STORIES_LIST_TEXT, reply_markup=keyboard),
+        callback.answer()
+    )
 
-@router.callback_query(F.data == "service_menu")
-async def service_menu(callback: CallbackQuery):
+async def service_menu(callback: CallbackQuery, arg: str):
     """Вернуться в главное меню"""
-    await callback.message.edit_text(
-        "🏠 Главное меню\n\nИспользуй кнопки ниже:",
-        reply_markup=None
+    await asyncio.gather(
+        callback.message.edit_text(
+            "🏠 Главное меню\n\nИспользуй кнопки ниже:",
+            reply_markup=None
+        ),
+        callback.answer()
     )
-    await callback.answer()
     # Отправляем новое сообщение с клавиатурой
     await callback.message.answer(
         "Выбери действие:",
         reply_markup=get_main_keyboard()
     )
 
-@router.callback_query(F.data.startswith("repeat_scene:"))
-async def repeat_scene(callback: CallbackQuery):
+async def repeat_scene(callback: CallbackQuery, arg: str):
     """Повторить текущую сцену"""
-    parts = callback.data.split(":")
-    run_id = int(parts[1])
-    scene_id = parts[2]
+    parts = arg.split(":")
+    run_id = int(parts[0])
+    scene_id = parts[1]
     
     result = await story_engine.continue_story(run_id)
     if result:
         text, keyboard, run_id = result
-        
-        await callback.message.answer(text, reply_markup=keyboard)
-        await callback.answer("✅ Сцена повторена")
+
+        await asyncio.gather(
+            callback.message.answer(text, reply_markup=keyboard),
+            callback.answer("✅ Сцена повторена")
+        )
     else:
         await callback.answer("❌ Ошибка", show_alert=True)
 
-@router.callback_query(F.data.startswith("reset_select:"))
-async def reset_select_story(callback: CallbackQuery):
+async def reset_select_story(callback: CallbackQuery, arg: str):
     """Выбор истории для сброса"""
-    story_id = callback.data.split(":", 1)[1]
+    story_id = arg
     
     story = story_engine.get_story(story_id)
     title = story.get("title", story_id) if story else story_id
@@ -428,43 +456,42 @@ async def reset_select_story(callback: CallbackQuery):
         ]
     ])
     
-    await callback.message.edit_text(
-        f"{CONFIRM_RESET}\n\nИстория: {title}",
-        reply_markup=keyboard
+    await asyncio.gather(
+        callback.message.edit_text(
+            f"{CONFIRM_RESET}\n\nИстория: {title}",
+            reply_markup=keyboard
+        ),
+        callback.answer()
     )
-    await callback.answer()
 
-@router.callback_query(F.data.startswith("reset_confirm:"))
-async def reset_confirm(callback: CallbackQuery):
+async def reset_confirm(callback: CallbackQuery, arg: str):
     """Подтверждение сброса прогресса"""
-    story_id = callback.data.split(":", 1)[1]
+    story_id = arg
     user_id = callback.from_user.id
     
     await RunRepository.reset_run(user_id, story_id)
     
     story = story_engine.get_story(story_id)
     title = story.get("title", story_id) if story else story_id
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📚 Истории", callback_data="show_stories:0")]
-    ])
-    
-    await callback.message.edit_text(
-        f"✅ Прогресс по истории «{title}» сброшен.\nМожешь начать заново.",
-        reply_markup=keyboard
+
+    await asyncio.gather(
+        callback.message.edit_text(
+            f"✅ Прогресс по истории «{title}» сброшен.\nМожешь начать заново.",
+            reply_markup=STORIES_LIST_KEYBOARD
+        ),
+        callback.answer("✅ Прогресс сброшен")
     )
-    await callback.answer("✅ Прогресс сброшен")
 
-@router.callback_query(F.data == "reset_cancel")
-async def reset_cancel(callback: CallbackQuery):
+async def reset_cancel(callback: CallbackQuery, arg: str):
     """Отмена сброса"""
-    await callback.message.edit_text("❌ Сброс отменён.")
-    await callback.answer()
+    await asyncio.gather(
+        callback.message.edit_text("❌ Сброс отменён."),
+        callback.answer()
+    )
 
-@router.callback_query(F.data.startswith("story_restart:"))
-async def restart_story(callback: CallbackQuery):
+async def restart_story(callback: CallbackQuery, arg: str):
     """Перезапуск истории"""
-    story_id = callback.data.split(":", 1)[1]
+    story_id = arg
     user_id = callback.from_user.id
     
     await RunRepository.reset_run(user_id, story_id)
@@ -473,9 +500,40 @@ async def restart_story(callback: CallbackQuery):
     
     if result:
         text, keyboard, run_id = result
-        
+
         # Сервисные кнопки убраны - навигация только через ReplyKeyboard
-        await callback.message.edit_text(text, reply_markup=keyboard)
-        await callback.answer("✅ История перезапущена")
+        await asyncio.gather(
+            callback.message.edit_text(text, reply_markup=keyboard),
+            callback.answer("✅ История перезапущена")
+        )
     else:
         await callback.answer("❌ Ошибка перезапуска", show_alert=True)
+
+# ==================== ДИСПЕТЧЕРИЗАЦИЯ CALLBACK ====================
+
+# Единая таблица префиксов callback_data вместо цепочки magic-фильтров:
+# один handler с O(1) dict-поиском вместо линейного перебора фильтров
+_CB_DISPATCH = {
+    "story_page": change_story_page,
+    "story_page_info": story_page_info,
+    "story_select": process_story_selection,
+    "story_start": start_story,
+    "story_continue": continue_story_callback,
+    "show_stories": show_stories_callback,
+    "service_menu": service_menu,
+    "repeat_scene": repeat_scene,
+    "reset_select": reset_select_story,
+    "reset_confirm": reset_confirm,
+    "reset_cancel": reset_cancel,
+    "story_restart": restart_story,
+}
+
+def _is_menu_callback(callback: CallbackQuery) -> bool:
+    """Фильтр: callback принадлежит меню (префикс есть в таблице)"""
+    return callback.data is not None and callback.data.partition(":")[0] in _CB_DISPATCH
+
+@router.callback_query(_is_menu_callback)
+async def dispatch_menu_callback(callback: CallbackQuery):
+    """Развести callback меню по таблице префиксов"""
+    prefix, _, arg = callback.data.partition(":")
+    await _CB_DISPATCH[prefix](callback, arg)
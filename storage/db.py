@@ -1,42 +1,171 @@
 """
 Инициализация и управление базой данных SQLite
 """
+import asyncio
+import os
 import aiosqlite
-from typing import Optional
+from typing import Dict, List, Optional
 from config import DB_PATH
 from utils.logger import logger
 
+# Размер пула соединений для читающих запросов
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "4"))
+
+class ConnectionPool:
+    """Небольшой пул соединений aiosqlite для читающих запросов"""
+
+    def __init__(self, db_path: str, size: int):
+        self.db_path = db_path
+        self.size = size
+        self._connections: List[aiosqlite.Connection] = []
+        self._available: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        """Открыть все соединения пула"""
+        for _ in range(self.size):
+            connection = await aiosqlite.connect(self.db_path, cached_statements=256)
+            # Кэш страниц и mmap - на каждое соединение отдельно
+            await connection.execute("PRAGMA temp_store=MEMORY")
+            await connection.execute("PRAGMA cache_size=-20000")
+            await connection.execute("PRAGMA mmap_size=268435456")
+            self._connections.append(connection)
+            self._available.put_nowait(connection)
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        for connection in self._connections:
+            await connection.close()
+        self._connections.clear()
+        self._available = asyncio.Queue()
+
+    def acquire(self):
+        """Взять соединение из пула (контекстный менеджер)"""
+        return _PooledConnection(self._available)
+
+class _PooledConnection:
+    """Контекстный менеджер, возвращающий соединение в пул при выходе"""
+
+    def __init__(self, available: asyncio.Queue):
+        self._available = available
+        self._connection: Optional[aiosqlite.Connection] = None
+
+    async def __aenter__(self) -> aiosqlite.Connection:
+        self._connection = await self._available.get()
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._available.put_nowait(self._connection)
+        self._connection = None
+
+class SceneWriteQueue:
+    """
+    Отложенная запись прогресса сцен (write-behind).
+
+    update_scene вызывается на каждый переход сцены, и каждый commit —
+    это fsync, который пользователь ждёт. Прогресс — восстановимое
+    состояние, поэтому записи накапливаются и сбрасываются фоновой
+    задачей раз в FLUSH_INTERVAL: дубликаты по run_id схлопываются
+    (остаётся последняя сцена), батч уходит одним executemany и одним
+    commit. Ценой крошечного окна потери при падении частота fsync
+    падает на порядок-два.
+    """
+
+    FLUSH_INTERVAL = 0.1  # секунды накопления батча
+
+    def __init__(self, database: "Database"):
+        self._db = database
+        self._pending: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, run_id: int, scene_id: str):
+        """Запланировать запись сцены (без ожидания commit)"""
+        self._pending[run_id] = scene_id
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Сбрасывать накопленные записи, пока они есть"""
+        while self._pending:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            await self._flush()
+
+    async def _flush(self):
+        """Записать накопленный батч одним запросом"""
+        if not self._pending:
+            return
+
+        batch = [(scene_id, run_id) for run_id, scene_id in self._pending.items()]
+        self._pending.clear()
+
+        try:
+            await self._db.connection.executemany(
+                "UPDATE runs SET current_scene = ? WHERE run_id = ?",
+                batch
+            )
+            await self._db.connection.commit()
+        except Exception as e:
+            logger.error("Ошибка отложенной записи сцен: %s", e, exc_info=True)
+
+    async def drain(self):
+        """Дождаться записи всего накопленного (вызывается при остановке)"""
+        if self._task is not None and not self._task.done():
+            await self._task
+        await self._flush()
+
 class Database:
     """Класс для работы с базой данных"""
-    
-    def __init__(self, db_path: str = DB_PATH):
+
+    def __init__(self, db_path: str = DB_PATH, pool_size: int = DB_POOL_SIZE):
         self.db_path = db_path
         self.connection: Optional[aiosqlite.Connection] = None
-    
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.scene_writes = SceneWriteQueue(self)
+
     async def connect(self):
         """Подключение к базе данных"""
-        self.connection = await aiosqlite.connect(self.db_path)
-        self.connection.row_factory = aiosqlite.Row
+        # row_factory не задаётся: строки приходят кортежами,
+        # репозитории распаковывают их позиционно без hash-поиска имён.
+        # Увеличенный кэш подготовленных выражений избавляет горячие
+        # запросы от повторного parse/plan (SQL вынесен в константы)
+        self.connection = await aiosqlite.connect(self.db_path, cached_statements=256)
+        # Включаем внешние ключи: удаление попытки каскадно чистит флаги
+        await self.connection.execute("PRAGMA foreign_keys=ON")
+        # WAL: читатели из пула не блокируются пишущим соединением,
+        # а commit при synchronous=NORMAL не ждёт полного fsync
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
+        await self.connection.execute("PRAGMA temp_store=MEMORY")
+        # 20 МБ кэша страниц и mmap для чтения без лишних копирований
+        await self.connection.execute("PRAGMA cache_size=-20000")
+        await self.connection.execute("PRAGMA mmap_size=268435456")
         await self.init_tables()
-        logger.info(f"Подключено к БД: {self.db_path}")
-    
+        await self.pool.open()
+        logger.info("Подключено к БД: %s (пул: %d)", self.db_path, self.pool.size)
+
     async def disconnect(self):
         """Отключение от базы данных"""
+        # Сначала дописываем отложенный прогресс сцен
+        await self.scene_writes.drain()
+        await self.pool.close()
         if self.connection:
             await self.connection.close()
             logger.info("Отключено от БД")
-    
+
     async def init_tables(self):
         """Инициализация таблиц"""
+        # Временные метки хранятся как INTEGER unix-секунды: гидратация
+        # через datetime.fromtimestamp (C-вызов) в разы дешевле разбора
+        # ISO-строк, а строка таблицы компактнее
         async with self.connection.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER DEFAULT (unixepoch())
             )
         """) as cursor:
             await self.connection.commit()
-        
+
         async with self.connection.execute("""
             CREATE TABLE IF NOT EXISTS runs (
                 run_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,38 +173,152 @@ class Database:
                 story_id TEXT NOT NULL,
                 current_scene TEXT NOT NULL,
                 is_finished INTEGER DEFAULT 0,
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                finished_at TIMESTAMP,
+                started_at INTEGER DEFAULT (unixepoch()),
+                finished_at INTEGER,
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
         """) as cursor:
             await self.connection.commit()
-        
+
         async with self.connection.execute("""
             CREATE TABLE IF NOT EXISTS flags (
                 run_id INTEGER NOT NULL,
                 flag_name TEXT NOT NULL,
                 flag_value TEXT NOT NULL,
                 PRIMARY KEY (run_id, flag_name),
-                FOREIGN KEY (run_id) REFERENCES runs(run_id)
+                FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE CASCADE
             )
         """) as cursor:
             await self.connection.commit()
-        
-        # Индексы для оптимизации
+
+        await self._migrate_flags_cascade()
+        await self._migrate_epoch_timestamps()
+
+        # Индексы для оптимизации.
+        # Покрывающий индекс для get_active_run/has_finished_run: кроме
+        # ключа поиска содержит все выбираемые колонки, поэтому SQLite
+        # отвечает из индекса без обращения к самой таблице
+        # (EXPLAIN QUERY PLAN: "USING COVERING INDEX")
+        await self.connection.execute("DROP INDEX IF EXISTS idx_runs_user_story")
         async with self.connection.execute("""
-            CREATE INDEX IF NOT EXISTS idx_runs_user_story 
-            ON runs(user_id, story_id, is_finished)
+            CREATE INDEX IF NOT EXISTS idx_runs_user_story_active
+            ON runs(user_id, story_id, is_finished, started_at DESC,
+                    run_id, current_scene, finished_at)
         """) as cursor:
             await self.connection.commit()
-        
+
         async with self.connection.execute("""
-            CREATE INDEX IF NOT EXISTS idx_flags_run 
+            CREATE INDEX IF NOT EXISTS idx_flags_run
             ON flags(run_id)
         """) as cursor:
             await self.connection.commit()
-        
+
+        # Индекс для выборки активных попыток пользователя
+        async with self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_runs_user_finished
+            ON runs(user_id, is_finished)
+        """) as cursor:
+            await self.connection.commit()
+
+        # Индекс для keyset-пагинации активных попыток по времени старта
+        async with self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_runs_active_started
+            ON runs(is_finished, started_at)
+        """) as cursor:
+            await self.connection.commit()
+
         logger.info("Таблицы БД инициализированы")
 
+    async def _migrate_flags_cascade(self):
+        """
+        Досоздать ON DELETE CASCADE на flags в существующих БД
+
+        CREATE TABLE IF NOT EXISTS не меняет схему уже созданной
+        таблицы, поэтому старые базы пересобираются через rename+copy.
+        """
+        async with self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='flags'"
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if not row or "ON DELETE CASCADE" in row[0]:
+            return
+
+        await self.connection.execute("ALTER TABLE flags RENAME TO flags_old")
+        await self.connection.execute("""
+            CREATE TABLE flags (
+                run_id INTEGER NOT NULL,
+                flag_name TEXT NOT NULL,
+                flag_value TEXT NOT NULL,
+                PRIMARY KEY (run_id, flag_name),
+                FOREIGN KEY (run_id) REFERENCES runs(run_id) ON DELETE CASCADE
+            )
+        """)
+        await self.connection.execute("INSERT INTO flags SELECT * FROM flags_old")
+        await self.connection.execute("DROP TABLE flags_old")
+        await self.connection.commit()
+        logger.info("Таблица flags пересобрана с ON DELETE CASCADE")
+
+    async def _migrate_epoch_timestamps(self):
+        """
+        Перевести текстовые временные метки существующих БД в unix-секунды
+
+        Старые базы хранят CURRENT_TIMESTAMP строками 'YYYY-MM-DD HH:MM:SS'
+        (UTC); strftime('%s', ...) конвертирует их в INTEGER при пересборке
+        таблиц. Внешние ключи на время пересборки отключаются, чтобы
+        DROP/RENAME не задевал ссылку flags -> runs.
+        """
+        async with self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='runs'"
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if not row or "unixepoch" in row[0]:
+            return
+
+        await self.connection.execute("PRAGMA foreign_keys=OFF")
+
+        await self.connection.execute("""
+            CREATE TABLE runs_new (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                story_id TEXT NOT NULL,
+                current_scene TEXT NOT NULL,
+                is_finished INTEGER DEFAULT 0,
+                started_at INTEGER DEFAULT (unixepoch()),
+                finished_at INTEGER,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        """)
+        await self.connection.execute("""
+            INSERT INTO runs_new
+            SELECT run_id, user_id, story_id, current_scene, is_finished,
+                   CAST(strftime('%s', started_at) AS INTEGER),
+                   CASE WHEN finished_at IS NULL THEN NULL
+                        ELSE CAST(strftime('%s', finished_at) AS INTEGER) END
+            FROM runs
+        """)
+        await self.connection.execute("DROP TABLE runs")
+        await self.connection.execute("ALTER TABLE runs_new RENAME TO runs")
+
+        await self.connection.execute("""
+            CREATE TABLE users_new (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                created_at INTEGER DEFAULT (unixepoch())
+            )
+        """)
+        await self.connection.execute("""
+            INSERT INTO users_new
+            SELECT user_id, username, CAST(strftime('%s', created_at) AS INTEGER)
+            FROM users
+        """)
+        await self.connection.execute("DROP TABLE users")
+        await self.connection.execute("ALTER TABLE users_new RENAME TO users")
+
+        await self.connection.commit()
+        await self.connection.execute("PRAGMA foreign_keys=ON")
+        logger.info("Временные метки переведены в unix-секунды")
+
 # Глобальный экземпляр БД
 db = Database()
@@ -1,6 +1,7 @@
 """
 Модели данных
 """
+import sys
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, Dict, Any
@@ -23,6 +24,13 @@ class Run:
     started_at: datetime
     finished_at: Optional[datetime] = None
 
+    def __post_init__(self):
+        # Интернируем идентификаторы: движок использует их как ключи
+        # индексов, и для интернированных строк сравнение при поиске
+        # в dict сводится к проверке указателя
+        self.story_id = sys.intern(self.story_id)
+        self.current_scene = sys.intern(self.current_scene)
+
 @dataclass
 class Flag:
     """Модель флага"""
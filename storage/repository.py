@@ -1,42 +1,146 @@
 """
 Репозиторий для работы с данными
 """
-from typing import Optional, List, Dict
+import asyncio
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime
 from storage.db import db
 from storage.models import User, Run, Flag
 from utils.logger import logger
 
+class _ResetBuffer:
+    """
+    Коалесцирующий буфер для reset_run.
+
+    Сбросы, пришедшие в течение короткого окна (например, скриптовые
+    массовые сбросы от админа), накапливаются и выполняются одним
+    SQL-запросом вместо пары запросов на каждый вызов.
+    """
+
+    MAX_BATCH = 50
+    MAX_LATENCY = 0.05  # секунды ожидания перед выполнением батча
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, user_id: int, story_id: str):
+        """Поставить сброс в очередь и дождаться его выполнения"""
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((user_id, story_id, fut))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+        await fut
+
+    async def _drain(self):
+        """Выполнить накопленные сбросы батчами"""
+        await asyncio.sleep(self.MAX_LATENCY)
+
+        while not self._queue.empty():
+            batch = []
+            while not self._queue.empty() and len(batch) < self.MAX_BATCH:
+                batch.append(self._queue.get_nowait())
+
+            pairs = [(user_id, story_id) for user_id, story_id, _ in batch]
+
+            try:
+                await RunRepository._reset_many(pairs)
+            except Exception as e:
+                logger.error("Ошибка батч-сброса попыток: %s", e, exc_info=True)
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for _, _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+
+_reset_buffer = _ResetBuffer()
+
+# Явный список колонок runs: строки читаются кортежами в фиксированном
+# порядке, без hash-поиска по имени колонки на каждое поле
+_RUN_COLUMNS = "run_id, user_id, story_id, current_scene, is_finished, started_at, finished_at"
+
+# SQL горячих запросов вынесен в константы: один и тот же объект строки
+# на каждый вызов повышает хит-рейт LRU-кэша подготовленных выражений
+# sqlite3 и избавляет от пересборки f-строк в рантайме
+_SQL_UPSERT_USER = """INSERT INTO users (user_id, username) VALUES (?, ?)
+   ON CONFLICT(user_id) DO UPDATE
+   SET username = COALESCE(excluded.username, users.username)
+   RETURNING user_id, username, created_at"""
+
+_SQL_CREATE_RUN = f"""INSERT INTO runs (user_id, story_id, current_scene, is_finished)
+   VALUES (?, ?, ?, 0)
+   RETURNING {_RUN_COLUMNS}"""
+
+_SQL_GET_ACTIVE_RUN = f"""SELECT {_RUN_COLUMNS} FROM runs
+   WHERE user_id = ? AND story_id = ? AND is_finished = 0
+   ORDER BY started_at DESC LIMIT 1"""
+
+_SQL_FINISH_RUN = """UPDATE runs
+   SET is_finished = 1, finished_at = unixepoch()
+   WHERE run_id = ?"""
+
+_SQL_GET_ALL_ACTIVE_RUNS = (
+    f"SELECT {_RUN_COLUMNS} FROM runs WHERE is_finished = 0 ORDER BY started_at DESC"
+)
+
+_SQL_HAS_FINISHED_RUN = """SELECT EXISTS(
+       SELECT 1 FROM runs
+       WHERE user_id = ? AND story_id = ? AND is_finished = 1
+   )"""
+
+_SQL_GET_ACTIVE_RUN_REFS = """SELECT run_id, story_id FROM runs
+   WHERE user_id = ? AND is_finished = 0
+   ORDER BY started_at DESC"""
+
+_SQL_GET_RUN_BY_ID = f"SELECT {_RUN_COLUMNS} FROM runs WHERE run_id = ?"
+
+_SQL_GET_FLAGS = "SELECT flag_name, flag_value FROM flags WHERE run_id = ?"
+
+_SQL_SET_FLAG = """INSERT OR REPLACE INTO flags (run_id, flag_name, flag_value)
+   VALUES (?, ?, ?)"""
+
+_SQL_REMOVE_FLAG = "DELETE FROM flags WHERE run_id = ? AND flag_name = ?"
+
+def _run_from_row(row: Tuple) -> Run:
+    """Собрать Run из кортежа в порядке _RUN_COLUMNS"""
+    # Метки хранятся unix-секундами: fromtimestamp - C-вызов,
+    # в разы быстрее разбора ISO-строки через fromisoformat
+    run_id, user_id, story_id, current_scene, is_finished, started_at, finished_at = row
+    return Run(
+        run_id=run_id,
+        user_id=user_id,
+        story_id=story_id,
+        current_scene=current_scene,
+        is_finished=bool(is_finished),
+        started_at=datetime.fromtimestamp(started_at),
+        finished_at=datetime.fromtimestamp(finished_at) if finished_at else None
+    )
+
 class UserRepository:
     """Репозиторий для работы с пользователями"""
     
     @staticmethod
     async def get_or_create(user_id: int, username: Optional[str] = None) -> User:
         """Получить или создать пользователя"""
+        # Один UPSERT вместо SELECT + INSERT: заодно освежает username
+        # (COALESCE не затирает сохранённый ник пустым значением)
         async with db.connection.execute(
-            "SELECT * FROM users WHERE user_id = ?",
-            (user_id,)
+            _SQL_UPSERT_USER, (user_id, username)
         ) as cursor:
             row = await cursor.fetchone()
-            
-            if row:
-                return User(
-                    user_id=row["user_id"],
-                    username=row["username"],
-                    created_at=datetime.fromisoformat(row["created_at"])
-                )
-        
-        # Создаём нового пользователя
-        async with db.connection.execute(
-            "INSERT INTO users (user_id, username) VALUES (?, ?)",
-            (user_id, username)
-        ) as cursor:
             await db.connection.commit()
-        
+
+        uid, uname, created_at = row
         return User(
-            user_id=user_id,
-            username=username,
-            created_at=datetime.now()
+            user_id=uid,
+            username=uname,
+            created_at=datetime.fromtimestamp(created_at)
         )
 
 class RunRepository:
@@ -45,114 +149,147 @@ class RunRepository:
     @staticmethod
     async def create(user_id: int, story_id: str, start_scene: str) -> Run:
         """Создать новую попытку прохождения"""
+        # RETURNING отдаёт вставленную строку сразу,
+        # без повторного SELECT по lastrowid
         async with db.connection.execute(
-            """INSERT INTO runs (user_id, story_id, current_scene, is_finished)
-               VALUES (?, ?, ?, 0)""",
-            (user_id, story_id, start_scene)
-        ) as cursor:
-            await db.connection.commit()
-            run_id = cursor.lastrowid
-        
-        async with db.connection.execute(
-            "SELECT * FROM runs WHERE run_id = ?",
-            (run_id,)
+            _SQL_CREATE_RUN, (user_id, story_id, start_scene)
         ) as cursor:
             row = await cursor.fetchone()
-        
-        return Run(
-            run_id=row["run_id"],
-            user_id=row["user_id"],
-            story_id=row["story_id"],
-            current_scene=row["current_scene"],
-            is_finished=bool(row["is_finished"]),
-            started_at=datetime.fromisoformat(row["started_at"]),
-            finished_at=datetime.fromisoformat(row["finished_at"]) if row["finished_at"] else None
-        )
+            await db.connection.commit()
+
+        return _run_from_row(row)
     
     @staticmethod
     async def get_active_run(user_id: int, story_id: str) -> Optional[Run]:
         """Получить активную попытку прохождения"""
         async with db.connection.execute(
-            """SELECT * FROM runs 
-               WHERE user_id = ? AND story_id = ? AND is_finished = 0
-               ORDER BY started_at DESC LIMIT 1""",
-            (user_id, story_id)
+            _SQL_GET_ACTIVE_RUN, (user_id, story_id)
         ) as cursor:
             row = await cursor.fetchone()
-            
+
             if not row:
                 return None
-            
-            return Run(
-                run_id=row["run_id"],
-                user_id=row["user_id"],
-                story_id=row["story_id"],
-                current_scene=row["current_scene"],
-                is_finished=bool(row["is_finished"]),
-                started_at=datetime.fromisoformat(row["started_at"]),
-                finished_at=datetime.fromisoformat(row["finished_at"]) if row["finished_at"] else None
-            )
+
+            return _run_from_row(row)
     
     @staticmethod
     async def update_scene(run_id: int, scene_id: str):
-        """Обновить текущую сцену"""
-        async with db.connection.execute(
-            "UPDATE runs SET current_scene = ? WHERE run_id = ?",
-            (scene_id, run_id)
-        ) as cursor:
-            await db.connection.commit()
+        """Обновить текущую сцену (запись отложенная, см. SceneWriteQueue)"""
+        db.scene_writes.put(run_id, scene_id)
     
     @staticmethod
     async def finish_run(run_id: int):
         """Завершить попытку прохождения"""
         async with db.connection.execute(
-            """UPDATE runs 
-               SET is_finished = 1, finished_at = CURRENT_TIMESTAMP 
-               WHERE run_id = ?""",
-            (run_id,)
+            _SQL_FINISH_RUN, (run_id,)
         ) as cursor:
             await db.connection.commit()
     
     @staticmethod
     async def get_all_active_runs() -> List[Run]:
         """Получить все активные попытки прохождения"""
+        # Читающий запрос идёт через пул, не занимая основное соединение
+        async with db.pool.acquire() as connection:
+            async with connection.execute(_SQL_GET_ALL_ACTIVE_RUNS) as cursor:
+                rows = await cursor.fetchall()
+
+        return [_run_from_row(row) for row in rows]
+    
+    @staticmethod
+    async def has_finished_run(user_id: int, story_id: str) -> bool:
+        """
+        Проверить, есть ли у пользователя завершённая попытка истории
+
+        SELECT EXISTS обрывает поиск на первой подходящей строке;
+        индекс (user_id, story_id, is_finished) покрывает проверку
+        целиком, без обращения к таблице.
+        """
         async with db.connection.execute(
-            "SELECT * FROM runs WHERE is_finished = 0 ORDER BY started_at DESC"
+            _SQL_HAS_FINISHED_RUN, (user_id, story_id)
         ) as cursor:
-            rows = await cursor.fetchall()
-        
-        return [
-            Run(
-                run_id=row["run_id"],
-                user_id=row["user_id"],
-                story_id=row["story_id"],
-                current_scene=row["current_scene"],
-                is_finished=bool(row["is_finished"]),
-                started_at=datetime.fromisoformat(row["started_at"]),
-                finished_at=datetime.fromisoformat(row["finished_at"]) if row["finished_at"] else None
-            )
-            for row in rows
-        ]
-    
+            row = await cursor.fetchone()
+            return bool(row[0])
+
+    @staticmethod
+    async def get_active_run_refs(user_id: int) -> List[Tuple[int, str]]:
+        """
+        Получить (run_id, story_id) активных попыток пользователя
+
+        Обработчикам меню не нужны временные метки, а их разбор через
+        datetime.fromisoformat — самая дорогая часть гидратации Run,
+        поэтому выбираются только две колонки без построения моделей.
+        Фильтрация идёт в SQL по индексу (user_id, is_finished).
+        """
+        async with db.pool.acquire() as connection:
+            async with connection.execute(
+                _SQL_GET_ACTIVE_RUN_REFS, (user_id,)
+            ) as cursor:
+                return list(await cursor.fetchall())
+
+    @staticmethod
+    async def get_active_runs_page(
+        limit: int,
+        before_ts: Optional[datetime] = None,
+        before_run_id: Optional[int] = None,
+    ) -> List[Run]:
+        """
+        Получить страницу активных попыток (keyset-пагинация)
+
+        Курсор составной: started_at хранится с точностью до секунды и
+        не уникален, поэтому строгое started_at < ? пропускало бы
+        попытки, начатые в ту же секунду, что и последняя строка
+        страницы. run_id дорезает границу внутри секунды.
+
+        Args:
+            limit: Максимальное число записей
+            before_ts: Вернуть только попытки, начатые не позже метки
+            before_run_id: Из попыток той же секунды - только с меньшим run_id
+
+        Returns:
+            Список Run, отсортированный по (started_at, run_id) по убыванию
+        """
+        query = f"SELECT {_RUN_COLUMNS} FROM runs WHERE is_finished = 0"
+        params: list = []
+
+        if before_ts is not None:
+            ts = int(before_ts.timestamp())
+            if before_run_id is not None:
+                query += " AND (started_at < ? OR (started_at = ? AND run_id < ?))"
+                params.extend((ts, ts, before_run_id))
+            else:
+                query += " AND started_at < ?"
+                params.append(ts)
+
+        query += " ORDER BY started_at DESC, run_id DESC LIMIT ?"
+        params.append(limit)
+
+        async with db.pool.acquire() as connection:
+            async with connection.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+
+        return [_run_from_row(row) for row in rows]
+
     @staticmethod
     async def reset_run(user_id: int, story_id: str):
         """Сбросить попытку прохождения (удалить активную)"""
-        # Удаляем флаги
-        async with db.connection.execute(
-            """DELETE FROM flags 
-               WHERE run_id IN (
-                   SELECT run_id FROM runs 
-                   WHERE user_id = ? AND story_id = ? AND is_finished = 0
-               )""",
-            (user_id, story_id)
-        ) as cursor:
-            await db.connection.commit()
-        
-        # Удаляем попытку
+        # Сбросы коалесцируются в батчи (см. _ResetBuffer)
+        await _reset_buffer.submit(user_id, story_id)
+
+    @staticmethod
+    async def _reset_many(pairs: List[Tuple[int, str]]):
+        """Сбросить несколько попыток одним запросом"""
+        if not pairs:
+            return
+
+        placeholders = ", ".join("(?, ?)" for _ in pairs)
+        params = [value for pair in pairs for value in pair]
+
+        # Флаги удаляет каскад по внешнему ключу (ON DELETE CASCADE),
+        # поэтому обходимся одним DELETE и одним commit/fsync
         async with db.connection.execute(
-            """DELETE FROM runs 
-               WHERE user_id = ? AND story_id = ? AND is_finished = 0""",
-            (user_id, story_id)
+            f"""DELETE FROM runs
+               WHERE is_finished = 0 AND (user_id, story_id) IN (VALUES {placeholders})""",
+            params
         ) as cursor:
             await db.connection.commit()
     
@@ -160,63 +297,120 @@ class RunRepository:
     async def _get_run_by_id(run_id: int) -> Optional[Run]:
         """Получить попытку прохождения по ID"""
         async with db.connection.execute(
-            "SELECT * FROM runs WHERE run_id = ?",
-            (run_id,)
+            _SQL_GET_RUN_BY_ID, (run_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            
+
             if not row:
                 return None
-            
-            return Run(
-                run_id=row["run_id"],
-                user_id=row["user_id"],
-                story_id=row["story_id"],
-                current_scene=row["current_scene"],
-                is_finished=bool(row["is_finished"]),
-                started_at=datetime.fromisoformat(row["started_at"]),
-                finished_at=datetime.fromisoformat(row["finished_at"]) if row["finished_at"] else None
-            )
+
+            return _run_from_row(row)
 
 class FlagRepository:
     """Репозиторий для работы с флагами"""
-    
+
+    # In-memory зеркало флагов по run_id: проверки флагов - самый
+    # внутренний цикл оценки условий сцены, и каждая ходка в SQLite
+    # там заметна. Кэш наполняется при первом get_flags, мутаторы
+    # обновляют его после commit. Записи удалённых попыток (сбросы
+    # каскадом) остаются мусором, но run_id не переиспользуются
+    # (AUTOINCREMENT), поэтому их просто вытесняет LRU.
+    _flag_cache: "OrderedDict[int, Dict[str, str]]" = OrderedDict()
+    _FLAG_CACHE_MAX = 1024
+
+    @staticmethod
+    def _cache_store(run_id: int, flags: Dict[str, str]):
+        """Положить флаги попытки в кэш с LRU-вытеснением"""
+        cache = FlagRepository._flag_cache
+        cache[run_id] = flags
+        cache.move_to_end(run_id)
+        while len(cache) > FlagRepository._FLAG_CACHE_MAX:
+            cache.popitem(last=False)
+
     @staticmethod
     async def get_flags(run_id: int) -> Dict[str, str]:
         """Получить все флаги для попытки прохождения"""
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            FlagRepository._flag_cache.move_to_end(run_id)
+            # Копия: вызывающий код может мутировать результат
+            return dict(cached)
+
         async with db.connection.execute(
-            "SELECT flag_name, flag_value FROM flags WHERE run_id = ?",
-            (run_id,)
+            _SQL_GET_FLAGS, (run_id,)
         ) as cursor:
             rows = await cursor.fetchall()
-        
-        return {row["flag_name"]: row["flag_value"] for row in rows}
-    
+
+        flags = {name: value for name, value in rows}
+        FlagRepository._cache_store(run_id, dict(flags))
+        return flags
+
     @staticmethod
     async def set_flag(run_id: int, flag_name: str, flag_value: str):
         """Установить флаг"""
         async with db.connection.execute(
-            """INSERT OR REPLACE INTO flags (run_id, flag_name, flag_value)
-               VALUES (?, ?, ?)""",
-            (run_id, flag_name, flag_value)
+            _SQL_SET_FLAG, (run_id, flag_name, flag_value)
         ) as cursor:
             await db.connection.commit()
-    
+
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            cached[flag_name] = flag_value
+
+    @staticmethod
+    async def set_flags_bulk(run_id: int, flags: Dict[str, str]):
+        """Установить несколько флагов одним запросом"""
+        if not flags:
+            return
+
+        await db.connection.executemany(
+            _SQL_SET_FLAG,
+            [(run_id, name, value) for name, value in flags.items()]
+        )
+        await db.connection.commit()
+
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            cached.update(flags)
+
+    @staticmethod
+    async def remove_flags_bulk(run_id: int, flag_names: List[str]):
+        """Удалить несколько флагов одним запросом"""
+        if not flag_names:
+            return
+
+        await db.connection.executemany(
+            _SQL_REMOVE_FLAG,
+            [(run_id, name) for name in flag_names]
+        )
+        await db.connection.commit()
+
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            for name in flag_names:
+                cached.pop(name, None)
+
     @staticmethod
     async def remove_flag(run_id: int, flag_name: str):
         """Удалить флаг"""
         async with db.connection.execute(
-            "DELETE FROM flags WHERE run_id = ? AND flag_name = ?",
-            (run_id, flag_name)
+            _SQL_REMOVE_FLAG, (run_id, flag_name)
         ) as cursor:
             await db.connection.commit()
-    
+
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            cached.pop(flag_name, None)
+
     @staticmethod
     async def has_flag(run_id: int, flag_name: str) -> bool:
         """Проверить наличие флага"""
-        async with db.connection.execute(
-            "SELECT 1 FROM flags WHERE run_id = ? AND flag_name = ? LIMIT 1",
-            (run_id, flag_name)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row is not None
+        cached = FlagRepository._flag_cache.get(run_id)
+        if cached is not None:
+            FlagRepository._flag_cache.move_to_end(run_id)
+            return flag_name in cached
+
+        # Промах - тянем и кэшируем весь набор флагов попытки:
+        # следующие проверки этого run_id обойдутся без БД
+        flags = await FlagRepository.get_flags(run_id)
+        return flag_name in flags
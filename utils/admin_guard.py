@@ -0,0 +1,43 @@
+"""
+Общая проверка прав администратора для админ-роутеров
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import ADMIN_USER_IDS
+
+# Множество для O(1) проверки прав администратора
+_ADMIN_IDS = frozenset(ADMIN_USER_IDS)
+
+ACCESS_DENIED_TEXT = "❌ Доступ запрещён. Только для администраторов."
+
+def is_admin(user_id: int) -> bool:
+    """Проверить, является ли пользователь администратором"""
+    return user_id in _ADMIN_IDS
+
+class AdminGuard(BaseMiddleware):
+    """
+    Middleware, пропускающий события только от администраторов.
+
+    Подключается как inner middleware роутера:
+        router.message.middleware(AdminGuard())
+    Проверка выполняется один раз до вызова обработчика,
+    поэтому в самих обработчиках дублировать is_admin не нужно.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None or user.id not in _ADMIN_IDS:
+            answer = getattr(event, "answer", None)
+            if answer is not None:
+                await answer(ACCESS_DENIED_TEXT)
+            return None
+
+        return await handler(event, data)
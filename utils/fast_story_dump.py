@@ -0,0 +1,158 @@
+"""
+Специализированный YAML-дампер под схему историй
+
+Обычный yaml.dump диспетчеризует representer по типу для каждого узла.
+Схема истории фиксированная (словари, списки выборов, скаляры), поэтому
+дамп можно собрать за один проход обычной сборкой строк — без per-node
+диспетчеризации PyYAML. Экранирование не упрощается: всё, что не
+проходит консервативную проверку на plain-скаляр, пишется двойными
+кавычками через json.dumps (JSON-строка — валидный YAML-скаляр).
+"""
+import json
+import re
+from typing import Any, List
+
+# Консервативный whitelist для скаляра без кавычек: буквы/цифры/пробелы
+# и безопасная пунктуация, без ведущих/замыкающих пробелов
+_PLAIN_SAFE_RE = re.compile(r"^[A-Za-zА-Яа-яЁё0-9_][A-Za-zА-Яа-яЁё0-9_ .,!?()/'-]*[A-Za-zА-Яа-яЁё0-9_.,!?()/'-]$|^[A-Za-zА-Яа-яЁё0-9_]$")
+
+# Слова, которые YAML распарсит не как строку
+_RESERVED = frozenset({"true", "false", "yes", "no", "on", "off", "null", "~"})
+
+# Похоже на число — нужно цитировать, чтобы не потерять тип str
+_NUMBER_LIKE_RE = re.compile(r"^[+-]?\d[\d_]*(\.\d*)?([eE][+-]?\d+)?$")
+
+# Целые в hex/octal/binary записи: SafeLoader разрешит 0x1A в int 26.
+# 0o-форма в YAML 1.1 остаётся строкой, но цитируем и её - лишние
+# кавычки безопасны, а загрузчик YAML 1.2 разрешил бы и её
+_INT_BASE_RE = re.compile(r"^[+-]?0[xXoObB][0-9a-fA-F_]+$")
+
+# Дата YAML 1.1: 2024-01-01 без кавычек загрузится как datetime.date.
+# Полные метки времени содержат ':' и не проходят _PLAIN_SAFE_RE
+_DATE_LIKE_RE = re.compile(r"^\d{4}-\d\d?-\d\d?$")
+
+def _plain_safe(value: str) -> bool:
+    """Можно ли записать строку без кавычек"""
+    if not _PLAIN_SAFE_RE.match(value):
+        return False
+    if value.lower() in _RESERVED:
+        return False
+    if _NUMBER_LIKE_RE.match(value):
+        return False
+    if _INT_BASE_RE.match(value) or _DATE_LIKE_RE.match(value):
+        return False
+    return True
+
+def _block_safe(value: str) -> bool:
+    """Можно ли записать многострочный текст блочным литералом"""
+    if value.startswith((" ", "\n")) or value.endswith("\n\n") or "\r" in value:
+        return False
+    # Замыкающие пробелы в строках теряются в блочном стиле
+    return not any(line != line.rstrip(" ") for line in value.split("\n"))
+
+def _scalar(value: Any) -> str:
+    """Отрендерить скаляр в однострочный YAML"""
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, str):
+        if "\n" not in value and _plain_safe(value):
+            return value
+        # json.dumps даёт валидный YAML-скаляр в двойных кавычках
+        return json.dumps(value, ensure_ascii=False)
+    raise TypeError(f"Неожиданный тип в истории: {type(value)!r}")
+
+def _emit_block_text(out: List[str], value: str, pad: str):
+    """Записать многострочный текст блочным литералом"""
+    out.append("|" if value.endswith("\n") and not value.endswith("\n\n") else "|-")
+    out.append("\n")
+    body = value[:-1] if value.endswith("\n") else value
+    for line in body.split("\n"):
+        if line:
+            out.append(pad)
+            out.append(line)
+        out.append("\n")
+
+def _emit(out: List[str], value: Any, indent: int):
+    """Записать значение value с отступом indent (рекурсивно)"""
+    pad = "  " * indent
+
+    if isinstance(value, dict):
+        if not value:
+            out.append(" {}\n")
+            return
+        out.append("\n")
+        for key, item in value.items():
+            out.append(pad)
+            out.append(_scalar(str(key) if not isinstance(key, str) else key))
+            out.append(":")
+            _emit(out, item, indent + 1)
+        return
+
+    if isinstance(value, list):
+        if not value:
+            out.append(" []\n")
+            return
+        out.append("\n")
+        for item in value:
+            out.append(pad)
+            out.append("-")
+            if isinstance(item, dict) and item:
+                # Первый ключ на строке с дефисом, остальные — под ним
+                first = True
+                for key, sub in item.items():
+                    if first:
+                        out.append(" ")
+                        first = False
+                    else:
+                        out.append(pad)
+                        out.append("  ")
+                    out.append(_scalar(key))
+                    out.append(":")
+                    _emit(out, sub, indent + 2)
+            else:
+                _emit_inline(out, item, indent + 1)
+        return
+
+    _emit_inline(out, value, indent)
+
+def _emit_inline(out: List[str], value: Any, indent: int):
+    """Записать скаляр после ключа или дефиса"""
+    if isinstance(value, str) and "\n" in value and _block_safe(value):
+        out.append(" ")
+        _emit_block_text(out, value, "  " * indent)
+        return
+    if isinstance(value, (dict, list)):
+        _emit(out, value, indent)
+        return
+    out.append(" ")
+    out.append(_scalar(value))
+    out.append("\n")
+
+def dump_story(story_data: dict) -> str:
+    """
+    Сдампить историю в YAML-строку за один проход
+
+    Args:
+        story_data: Данные истории
+
+    Returns:
+        YAML строка
+
+    Raises:
+        TypeError: Встретился тип вне схемы истории (вызывающий
+            откатывается на обычный yaml.dump)
+    """
+    out: List[str] = []
+    for key, value in story_data.items():
+        out.append(_scalar(key if isinstance(key, str) else str(key)))
+        out.append(":")
+        _emit(out, value, 1)
+    return "".join(out)
@@ -3,34 +3,49 @@
 """
 import logging
 import sys
-from typing import Optional
+
+# Корневой логгер настраивается один раз при первом импорте модуля:
+# дочерние логгеры наследуют handler через propagate, без проверки
+# logger.handlers на каждый вызов setup_logger
+_configured = False
+
+def _configure_root(level: int = logging.INFO):
+    """Настроить корневой логгер (выполняется однократно)"""
+    global _configured
+    if _configured:
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    _configured = True
 
 def setup_logger(name: str, level: int = logging.INFO) -> logging.Logger:
     """
-    Настройка логгера
-    
+    Получить логгер по имени
+
+    Конфигурация (handler, формат) живёт на корневом логгере,
+    поэтому здесь остаётся только logging.getLogger.
+
     Args:
         name: Имя логгера
-        level: Уровень логирования
-    
+        level: Уровень корневого логгера (учитывается при первой настройке)
+
     Returns:
-        Настроенный логгер
+        Логгер с именем name
     """
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    
-    if not logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(level)
-        
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-    
-    return logger
+    _configure_root(level)
+    return logging.getLogger(name)
+
+_configure_root()
 
 # Глобальный логгер
-logger = setup_logger(__name__)
+logger = logging.getLogger(__name__)
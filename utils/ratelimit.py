@@ -0,0 +1,103 @@
+"""
+Ограничение частоты исходящих сообщений
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Dict
+
+from aiogram.types import Message
+
+class AsyncLimiter:
+    """
+    Лимитер скользящего окна: не более rate событий за per секунд.
+
+    В отличие от token-bucket для входящих команд, этот лимитер не
+    отбрасывает события, а дожидается свободного слота.
+    """
+
+    def __init__(self, rate: int, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self._events: deque = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Дождаться свободного слота в окне"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                while self._events and now - self._events[0] >= self.per:
+                    self._events.popleft()
+
+                if len(self._events) < self.rate:
+                    self._events.append(now)
+                    return
+
+                await asyncio.sleep(self.per - (now - self._events[0]))
+
+# Глобальный лимит Bot API ~30 msg/s, держим запас
+_global_limiter = AsyncLimiter(rate=25, per=1.0)
+
+# Telegram ограничивает ~1 msg/s в один чат
+_chat_limiters: Dict[int, AsyncLimiter] = {}
+
+# Лимит длины одного сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+def chunk_lines(text: str, size: int = MAX_MESSAGE_LENGTH):
+    """
+    Разбить текст на части не длиннее size по границам строк
+
+    Args:
+        text: Исходный текст
+        size: Максимальная длина части
+
+    Yields:
+        Части текста, целиком состоящие из полных строк
+        (строка длиннее size режется по лимиту)
+    """
+    buf = []
+    n = 0
+
+    for line in text.splitlines(keepends=True):
+        # Строка сама длиннее лимита - режем её по size
+        while len(line) > size:
+            if buf:
+                yield "".join(buf)
+                buf = []
+                n = 0
+            yield line[:size]
+            line = line[size:]
+
+        if n + len(line) > size and buf:
+            yield "".join(buf)
+            buf = []
+            n = 0
+
+        if line:
+            buf.append(line)
+            n += len(line)
+
+    if buf:
+        yield "".join(buf)
+
+async def answer_chunked(message: Message, text: str):
+    """
+    Отправить длинный текст по частям с учётом лимитов Telegram
+
+    Args:
+        message: Входящее сообщение, на которое отвечаем
+        text: Полный текст ответа
+    """
+    limiter = _chat_limiters.setdefault(message.chat.id, AsyncLimiter(rate=1, per=1.0))
+
+    if len(text) <= MAX_MESSAGE_LENGTH:
+        await message.answer(text)
+        return
+
+    for chunk in chunk_lines(text):
+        await _global_limiter.acquire()
+        await limiter.acquire()
+        await message.answer(chunk)
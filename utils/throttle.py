@@ -0,0 +1,55 @@
+"""
+Token-bucket ограничитель частоты команд
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils.logger import logger
+
+class TokenBucketMiddleware(BaseMiddleware):
+    """
+    Middleware с token-bucket на пользователя.
+
+    Скриптовые серии команд (например, массовые /reset_story) сверх
+    лимита молча отбрасываются, чтобы не упереться в глобальный лимит
+    Bot API ~30 msg/s и не словить каскад RetryAfter.
+
+    Подключается как inner middleware роутера:
+        router.message.middleware(TokenBucketMiddleware())
+    """
+
+    def __init__(self, rate: float = 25.0, capacity: float = 30.0):
+        self.rate = rate          # пополнение токенов в секунду
+        self.capacity = capacity  # максимальный размер "ведра"
+        # user_id -> (остаток токенов, время последнего обновления)
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is not None and not self._try_acquire(user.id):
+            logger.debug("Команда пользователя %s отброшена throttling-ом", user.id)
+            return None
+
+        return await handler(event, data)
+
+    def _try_acquire(self, key: int) -> bool:
+        """Взять один токен из ведра; False если токенов нет"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+        if tokens < 1.0:
+            self._buckets[key] = (tokens, now)
+            return False
+
+        self._buckets[key] = (tokens - 1.0, now)
+        return True
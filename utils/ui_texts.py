@@ -1,6 +1,7 @@
 """
 Тексты для пользовательского интерфейса
 """
+import functools
 from typing import Optional
 
 # Приветствие
@@ -35,8 +36,9 @@ STORIES_LIST_TEXT = "📚 Выбери историю:"
 NO_STORIES_TEXT = "📚 Истории пока не загружены.\nПопробуй позже или обратись к администратору."
 
 # Карточка истории
+@functools.lru_cache(maxsize=256)
 def get_story_card(title: str, description: Optional[str], version: str) -> str:
-    """Форматировать карточку истории"""
+    """Форматировать карточку истории (кэшируется по аргументам)"""
     text = f"📖 {title}\n"
     if description:
         text += f"\n{description}\n"
@@ -2,111 +2,280 @@
 Утилиты для работы с YAML файлами историй
 """
 import yaml
-import re
+import asyncio
+import copy
+import functools
+import os
+import pickle
+import string
+from io import BytesIO
+
+import aiofiles
+
+# C-ускоренные Loader/Dumper из libyaml, с фолбэком на чистый Python
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Optional
 from config import STORIES_DIR
+from utils.fast_story_dump import dump_story
 from utils.logger import logger
 
 # Максимальный размер текста на сообщение
 MAX_TEXT_LENGTH = 8000
 
+# Константные пути собираются один раз при импорте: разбор строки в Path
+# не бесплатный, а каталоги достаточно создать однажды
+_STORIES_PATH = Path(STORIES_DIR)
+_DELETED_PATH = _STORIES_PATH / "_deleted"
+_STORIES_PATH.mkdir(exist_ok=True)
+_DELETED_PATH.mkdir(exist_ok=True)
+
+# Таблица санитайзера: разрешённые символы отображаются сами в себя,
+# всё остальное __missing__ удаляет (None). str.translate - один
+# C-цикл без регулярного движка; sanitize_story_id стоит на входе
+# каждой публичной функции модуля
+class _KeepTable(dict):
+    """Таблица трансляции, удаляющая все не перечисленные символы"""
+
+    def __missing__(self, code: int):
+        return None
+
+_SANITIZE_TABLE = _KeepTable(
+    (ord(c), c) for c in string.ascii_letters + string.digits + '_-'
+)
+_BAD_SUBSTRINGS = ('/', '\\', '..')
+
+# Разделяемый пустой список для .get по choices (только чтение)
+_EMPTY_CHOICES: list = []
+
+# Кэш разобранных историй: story_id -> ((mtime_ns, размер), данные)
+# Позволяет серии админ-команд по одной истории обойтись одним парсингом.
+# Размер в ключе страхует от правок, не сдвинувших mtime
+_story_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+def _invalidate_story_cache(story_id: str):
+    """Убрать историю из кэша разобранных файлов"""
+    _story_cache.pop(story_id, None)
+
+# Дисковый pickle-сайдкар разобранных историй: тот же каталог, формат
+# и штамп (mtime_ns, размер), что у загрузчика движка (_parse_story_file),
+# поэтому записи общие - кто распарсил первым, тот и наполнил кэш.
+# Загрузка pickle на порядок дешевле парсинга YAML
+_PARSE_CACHE_DIR = _STORIES_PATH / ".cache"
+
+def _load_parsed_cache(file_path: Path, stamp: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+    """Прочитать разобранную историю из сайдкара (None при промахе)"""
+    cache_file = _PARSE_CACHE_DIR / (file_path.name + ".pkl")
+    try:
+        with open(cache_file, "rb") as f:
+            cached_stamp, data = pickle.load(f)
+        if cached_stamp == stamp:
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.debug("Кэш истории не прочитан (%s): %s", cache_file.name, e)
+    return None
+
+def _store_parsed_cache(file_path: Path, stamp: Tuple[int, int], data: Dict[str, Any]) -> None:
+    """Записать разобранную историю в сайдкар (сбой не фатален)"""
+    cache_file = _PARSE_CACHE_DIR / (file_path.name + ".pkl")
+    try:
+        _PARSE_CACHE_DIR.mkdir(exist_ok=True)
+        tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump((stamp, data), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.debug("Кэш истории не записан (%s): %s", cache_file.name, e)
+
+def _atomic_write(file_path: Path, payload: bytes) -> None:
+    """
+    Атомарная запись файла: tmp-файл + fsync + os.replace
+
+    Читатели в любой момент видят либо старую, либо новую версию файла,
+    но никогда — частично записанную.
+    """
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        # Не оставляем осиротевший tmp-файл рядом с историями
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class StoryWriter:
+    """
+    Отложенная запись историй на диск.
+
+    Сохранения копятся в буфере и сбрасываются одной пачкой раз в окно;
+    повторные сохранения одной истории схлопываются (побеждает последняя
+    версия), так что серия правок делает один fsync вместо N. Цена —
+    крошечное окно недолговечности между ответом админу и записью.
+    """
+
+    # Окно коалесценции записей
+    WINDOW = 0.1
+
+    def __init__(self):
+        # story_id -> готовые байты YAML (последняя версия)
+        self._pending: Dict[str, bytes] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, sanitized_id: str, payload: bytes):
+        """Поставить готовый YAML в очередь записи (возврат немедленный)"""
+        self._pending[sanitized_id] = payload
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        """Сбросить накопленные записи на диск одной пачкой"""
+        await asyncio.sleep(self.WINDOW)
+
+        while self._pending:
+            pending, self._pending = self._pending, {}
+
+            for story_id, payload in pending.items():
+                file_path = _STORIES_PATH / f"{story_id}.yaml"
+                try:
+                    await asyncio.to_thread(_atomic_write, file_path, payload)
+                    logger.info("История сохранена: %s", story_id)
+                except Exception as e:
+                    logger.error("Ошибка записи истории %s: %s", story_id, e)
+
+_story_writer = StoryWriter()
+
+@functools.lru_cache(maxsize=256)
 def sanitize_story_id(story_id: str) -> Optional[str]:
     """
     Очистка и валидация story_id для защиты от path traversal
-    
+
+    Функция чистая, поэтому результат кэшируется: один и тот же
+    небольшой набор ID проверяется на входе каждой публичной функции.
+
     Args:
         story_id: ID истории
-    
+
     Returns:
         Очищенный story_id или None если невалидный
     """
     if not story_id:
         return None
-    
+
     # Удаляем опасные символы
-    sanitized = re.sub(r'[^a-zA-Z0-9_-]', '', story_id)
-    
+    sanitized = story_id.translate(_SANITIZE_TABLE)
+
     # Проверяем, что не пустой и не содержит путь
-    if not sanitized or '/' in story_id or '\\' in story_id or '..' in story_id:
+    if not sanitized or any(bad in story_id for bad in _BAD_SUBSTRINGS):
         return None
-    
+
     return sanitized
 
-def validate_story(story_data: Dict[str, Any]) -> Tuple[bool, List[str]]:
+def validate_story(story_data: Dict[str, Any], fail_fast: bool = False) -> Tuple[bool, List[str], List[str]]:
     """
     Валидация структуры истории
-    
+
     Args:
         story_data: Данные истории из YAML
-    
+        fail_fast: Вернуться на первой же ошибке, не собирая полный список
+            (для пути сохранения, где важен только вердикт пройдено/нет)
+
     Returns:
-        Кортеж (валидна ли история, список ошибок/предупреждений)
+        Кортеж (валидна ли история, список ошибок, список предупреждений)
     """
-    errors = []
-    warnings = []
-    
+    errors: List[str] = []
+    warnings: List[str] = []
+
+    # Связываем горячие методы с локальными именами: в циклах по сценам
+    # и выборам это убирает LOAD_ATTR/LOAD_METHOD на каждую итерацию
+    get = story_data.get
+    add_error = errors.append
+    add_warning = warnings.append
+
     # Проверка обязательных полей
-    if not story_data.get("id"):
-        errors.append("Отсутствует обязательное поле 'id'")
-    
-    if not story_data.get("title"):
-        warnings.append("Отсутствует поле 'title'")
-    
-    if not story_data.get("start_scene"):
-        errors.append("Отсутствует обязательное поле 'start_scene'")
-    
+    if not get("id"):
+        add_error("Отсутствует обязательное поле 'id'")
+        if fail_fast:
+            return False, errors, warnings
+
+    if not get("title"):
+        add_warning("Отсутствует поле 'title'")
+
+    if not get("start_scene"):
+        add_error("Отсутствует обязательное поле 'start_scene'")
+        if fail_fast:
+            return False, errors, warnings
+
     # Проверка сцен
-    scenes = story_data.get("scenes", {})
+    scenes = get("scenes", {})
     if not scenes:
-        errors.append("История должна содержать хотя бы одну сцену")
-    
-    start_scene = story_data.get("start_scene")
-    if start_scene and start_scene not in scenes:
-        # Проверяем, может это ending
-        endings = story_data.get("endings", {})
-        if start_scene not in endings:
-            errors.append(f"start_scene '{start_scene}' не найден в scenes или endings")
-    
+        add_error("История должна содержать хотя бы одну сцену")
+        if fail_fast:
+            return False, errors, warnings
+
+    # Допустимые цели переходов собираются один раз: объединение
+    # dict-view даёт set с O(1) проверкой членства во внутреннем цикле
+    endings = get("endings") or {}
+    valid_targets = scenes.keys() | endings.keys()
+
+    start_scene = get("start_scene")
+    if start_scene and start_scene not in valid_targets:
+        add_error(f"start_scene '{start_scene}' не найден в scenes или endings")
+        if fail_fast:
+            return False, errors, warnings
+
     # Проверка сцен на наличие текста и валидность выборов
     for scene_id, scene in scenes.items():
-        if not scene.get("text"):
-            warnings.append(f"Сцена '{scene_id}' не содержит текста")
-        
-        choices = scene.get("choices", [])
-        for i, choice in enumerate(choices):
-            if not choice.get("id"):
-                errors.append(f"Выбор #{i+1} в сцене '{scene_id}' не имеет id")
-            
-            if not choice.get("text"):
-                warnings.append(f"Выбор #{i+1} в сцене '{scene_id}' не имеет текста")
-            
-            next_scene = choice.get("next_scene")
+        scene_get = scene.get
+        if not scene_get("text"):
+            add_warning(f"Сцена '{scene_id}' не содержит текста")
+
+        choices = scene_get("choices", _EMPTY_CHOICES)
+        for i, choice in enumerate(choices, start=1):
+            choice_get = choice.get
+            if not choice_get("id"):
+                add_error(f"Выбор #{i} в сцене '{scene_id}' не имеет id")
+                if fail_fast:
+                    return False, errors, warnings
+
+            if not choice_get("text"):
+                add_warning(f"Выбор #{i} в сцене '{scene_id}' не имеет текста")
+
+            next_scene = choice_get("next_scene")
             if not next_scene:
-                errors.append(f"Выбор '{choice.get('id', 'unknown')}' в сцене '{scene_id}' не имеет next_scene")
-            else:
-                # Проверяем, что next_scene существует
-                endings = story_data.get("endings", {})
-                if next_scene not in scenes and next_scene not in endings:
-                    errors.append(
-                        f"Выбор '{choice.get('id', 'unknown')}' в сцене '{scene_id}' "
-                        f"ведёт на несуществующую сцену/финал '{next_scene}'"
-                    )
-    
+                add_error(f"Выбор '{choice_get('id', 'unknown')}' в сцене '{scene_id}' не имеет next_scene")
+                if fail_fast:
+                    return False, errors, warnings
+            elif next_scene not in valid_targets:
+                add_error(
+                    f"Выбор '{choice_get('id', 'unknown')}' в сцене '{scene_id}' "
+                    f"ведёт на несуществующую сцену/финал '{next_scene}'"
+                )
+                if fail_fast:
+                    return False, errors, warnings
+
     # Проверка финалов
-    endings = story_data.get("endings", {})
     for ending_id, ending in endings.items():
-        if not ending.get("text"):
-            warnings.append(f"Финал '{ending_id}' не содержит текста")
-        
-        ending_type = ending.get("ending_type", "neutral")
-        if ending_type not in ["success", "failure", "neutral"]:
-            warnings.append(f"Финал '{ending_id}' имеет нестандартный ending_type: {ending_type}")
-    
-    is_valid = len(errors) == 0
-    all_issues = errors + warnings
+        ending_get = ending.get
+        if not ending_get("text"):
+            add_warning(f"Финал '{ending_id}' не содержит текста")
+
+        ending_type = ending_get("ending_type", "neutral")
+        if ending_type not in ("success", "failure", "neutral"):
+            add_warning(f"Финал '{ending_id}' имеет нестандартный ending_type: {ending_type}")
     
-    return is_valid, all_issues
+    return not errors, errors, warnings
 
 def parse_yaml(yaml_text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """
@@ -119,7 +288,7 @@ def parse_yaml(yaml_text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]
         Кортеж (данные истории или None, ошибка или None)
     """
     try:
-        data = yaml.safe_load(yaml_text)
+        data = yaml.load(yaml_text, Loader=SafeLoader)
         if not data:
             return None, "YAML файл пуст"
         return data, None
@@ -132,14 +301,17 @@ def parse_yaml(yaml_text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]
         logger.error(error_msg)
         return None, error_msg
 
-def save_story(story_id: str, story_data: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+def save_story(story_id: str, story_data: Dict[str, Any], assume_valid: bool = False) -> Tuple[bool, Optional[str]]:
     """
     Сохранение истории в файл
-    
+
     Args:
         story_id: ID истории
         story_data: Данные истории
-    
+        assume_valid: Пропустить валидацию структуры (только для данных,
+            которые уже прошли её: загружено из файла и правились
+            неструктурные поля)
+
     Returns:
         Кортеж (успешно ли сохранено, ошибка или None)
     """
@@ -147,37 +319,44 @@ def save_story(story_id: str, story_data: Dict[str, Any]) -> Tuple[bool, Optiona
     sanitized_id = sanitize_story_id(story_id)
     if not sanitized_id:
         return False, "Невалидный story_id"
-    
-    # Валидация данных
-    is_valid, issues = validate_story(story_data)
-    if not is_valid:
-        errors = [i for i in issues if "Отсутствует" in i or "не найден" in i or "не имеет" in i]
-        if errors:
-            return False, f"Ошибки валидации: {'; '.join(errors[:3])}"
+
+    # Валидация данных: здесь нужен только вердикт, поэтому fail_fast
+    # обрывает обход на первой ошибке вместо полного отчёта
+    if not assume_valid:
+        is_valid, verrors, _warnings = validate_story(story_data, fail_fast=True)
+        if not is_valid:
+            return False, f"Ошибки валидации: {'; '.join(verrors[:3])}"
     
     # Сохранение
     try:
-        stories_path = Path(STORIES_DIR)
-        stories_path.mkdir(exist_ok=True)
-        
-        file_path = stories_path / f"{sanitized_id}.yaml"
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            yaml.dump(story_data, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
-        
-        logger.info(f"История сохранена: {sanitized_id}")
+        file_path = _STORIES_PATH / f"{sanitized_id}.yaml"
+
+        buf = BytesIO()
+        dump_story_yaml(story_data, buf)
+        _atomic_write(file_path, buf.getvalue())
+
+        # Сразу кладём разобранные данные в сайдкар: ближайшая загрузка
+        # (и рестарт движка) обойдётся без парсинга только что
+        # записанного YAML
+        st = os.stat(file_path)
+        _store_parsed_cache(file_path, (st.st_mtime_ns, st.st_size), story_data)
+
+        _invalidate_story_cache(sanitized_id)
+        logger.info("История сохранена: %s", sanitized_id)
         return True, None
     except Exception as e:
         error_msg = f"Ошибка сохранения: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
-def load_story_file(story_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+def load_story_file(story_id: str, mutable: bool = False) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """
     Загрузка истории из файла
     
     Args:
         story_id: ID истории
+        mutable: Вернуть данные без защитной deepcopy (владение передаётся
+            вызывающему, запись в кэше сбрасывается)
     
     Returns:
         Кортеж (данные истории или None, ошибка или None)
@@ -187,33 +366,171 @@ def load_story_file(story_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[s
         return None, "Невалидный story_id"
     
     try:
-        stories_path = Path(STORIES_DIR)
-        file_path = stories_path / f"{sanitized_id}.yaml"
-        
-        if not file_path.exists():
-            return None, f"Файл истории '{sanitized_id}' не найден"
-        
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
-        
-        if not data:
-            return None, "Файл истории пуст"
-        
+        file_path = _STORIES_PATH / f"{sanitized_id}.yaml"
+
+        # EAFP: stat и открывает, и проверяет существование - без
+        # отдельного exists() перед ним
+        st = os.stat(file_path)
+
+        # Если файл не менялся с прошлой загрузки, отдаём данные из кэша
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _story_cache.get(sanitized_id)
+        if cached and cached[0] == stamp:
+            if mutable:
+                # Передаём владение: вызывающий будет мутировать структуру
+                _story_cache.pop(sanitized_id, None)
+                return cached[1], None
+            return copy.deepcopy(cached[1]), None
+
+        # Дисковый сайдкар: после рестарта или сохранения экономит парсинг
+        data = _load_parsed_cache(file_path, stamp)
+
+        if data is None:
+            # Бинарный режим: libyaml декодирует utf-8 сам, без лишнего
+            # прохода декодером на уровне Python
+            with open(file_path, "rb") as f:
+                data = yaml.load(f, Loader=SafeLoader)
+
+            if not data:
+                return None, "Файл истории пуст"
+
+            _store_parsed_cache(file_path, stamp, data)
+
+        if not mutable:
+            _story_cache[sanitized_id] = (stamp, copy.deepcopy(data))
+
         return data, None
+    except FileNotFoundError:
+        return None, f"Файл истории '{sanitized_id}' не найден"
     except yaml.YAMLError as e:
         return None, f"Ошибка парсинга YAML: {str(e)}"
     except Exception as e:
         return None, f"Ошибка загрузки: {str(e)}"
 
+async def aload_story_file(story_id: str, mutable: bool = False) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Асинхронная загрузка истории: чтение через aiofiles, парсинг в потоке
+
+    Args:
+        story_id: ID истории
+        mutable: Вернуть данные без защитной deepcopy (владение передаётся
+            вызывающему, запись в кэше сбрасывается)
+
+    Returns:
+        Кортеж (данные истории или None, ошибка или None)
+    """
+    sanitized_id = sanitize_story_id(story_id)
+    if not sanitized_id:
+        return None, "Невалидный story_id"
+
+    try:
+        file_path = _STORIES_PATH / f"{sanitized_id}.yaml"
+
+        # EAFP: несуществующий файл ловим по FileNotFoundError от stat
+        st = os.stat(file_path)
+
+        # Если файл не менялся с прошлой загрузки, отдаём данные из кэша
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _story_cache.get(sanitized_id)
+        if cached and cached[0] == stamp:
+            if mutable:
+                # Передаём владение: вызывающий будет мутировать структуру
+                _story_cache.pop(sanitized_id, None)
+                return cached[1], None
+            return copy.deepcopy(cached[1]), None
+
+        # Дисковый сайдкар: после рестарта или сохранения экономит парсинг
+        data = await asyncio.to_thread(_load_parsed_cache, file_path, stamp)
+
+        if data is None:
+            async with aiofiles.open(file_path, "rb") as f:
+                raw = await f.read()
+
+            # PyYAML не умеет читать асинхронный файл, поэтому парсим байты в потоке
+            data = await asyncio.to_thread(yaml.load, raw, SafeLoader)
+
+            if not data:
+                return None, "Файл истории пуст"
+
+            await asyncio.to_thread(_store_parsed_cache, file_path, stamp, data)
+
+        if not mutable:
+            _story_cache[sanitized_id] = (stamp, copy.deepcopy(data))
+
+        return data, None
+    except FileNotFoundError:
+        return None, f"Файл истории '{sanitized_id}' не найден"
+    except yaml.YAMLError as e:
+        return None, f"Ошибка парсинга YAML: {str(e)}"
+    except Exception as e:
+        return None, f"Ошибка загрузки: {str(e)}"
+
+async def asave_story(story_id: str, story_data: Dict[str, Any], assume_valid: bool = False) -> Tuple[bool, Optional[str]]:
+    """
+    Асинхронное сохранение истории: дамп в потоке, отложенная атомарная запись
+
+    Args:
+        story_id: ID истории
+        story_data: Данные истории
+        assume_valid: Пропустить валидацию структуры (только для данных,
+            которые уже прошли её: загружено из файла и правились
+            неструктурные поля)
+
+    Returns:
+        Кортеж (успешно ли сохранено, ошибка или None)
+    """
+    # Валидация story_id
+    sanitized_id = sanitize_story_id(story_id)
+    if not sanitized_id:
+        return False, "Невалидный story_id"
+
+    # Валидация данных: здесь нужен только вердикт, поэтому fail_fast
+    # обрывает обход на первой ошибке вместо полного отчёта
+    if not assume_valid:
+        is_valid, verrors, _warnings = await asyncio.to_thread(
+            validate_story, story_data, True
+        )
+        if not is_valid:
+            return False, f"Ошибки валидации: {'; '.join(verrors[:3])}"
+
+    # Сохранение: дамп в потоке, запись — через отложенный StoryWriter
+    try:
+        buf = BytesIO()
+        await asyncio.to_thread(dump_story_yaml, story_data, buf)
+
+        _story_writer.enqueue(sanitized_id, buf.getvalue())
+        _invalidate_story_cache(sanitized_id)
+        return True, None
+    except Exception as e:
+        error_msg = f"Ошибка сохранения: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+# Кэш листинга каталога историй: создание/удаление/переименование файла
+# меняет mtime каталога, поэтому по нему видно, актуален ли список.
+# Проверка существования - set-lookup вместо stat на каждый вызов
+_dir_cache: Dict[str, Any] = {"mtime_ns": -1, "names": frozenset()}
+
 def story_exists(story_id: str) -> bool:
     """Проверить, существует ли история"""
     sanitized_id = sanitize_story_id(story_id)
     if not sanitized_id:
         return False
-    
-    stories_path = Path(STORIES_DIR)
-    file_path = stories_path / f"{sanitized_id}.yaml"
-    return file_path.exists()
+
+    try:
+        st = os.stat(STORIES_DIR)
+    except OSError:
+        return False
+
+    if st.st_mtime_ns != _dir_cache["mtime_ns"]:
+        with os.scandir(STORIES_DIR) as entries:
+            _dir_cache["names"] = frozenset(
+                entry.name for entry in entries
+                if entry.is_file() and entry.name.endswith(".yaml")
+            )
+        _dir_cache["mtime_ns"] = st.st_mtime_ns
+
+    return f"{sanitized_id}.yaml" in _dir_cache["names"]
 
 def delete_story(story_id: str, move_to_deleted: bool = True) -> Tuple[bool, Optional[str]]:
     """
@@ -231,31 +548,123 @@ def delete_story(story_id: str, move_to_deleted: bool = True) -> Tuple[bool, Opt
         return False, "Невалидный story_id"
     
     try:
-        stories_path = Path(STORIES_DIR)
-        file_path = stories_path / f"{sanitized_id}.yaml"
-        
-        if not file_path.exists():
-            return False, f"Файл истории '{sanitized_id}' не найден"
-        
+        file_path = _STORIES_PATH / f"{sanitized_id}.yaml"
+
+        # EAFP: replace/unlink сами сообщат об отсутствии файла,
+        # отдельный exists() был бы лишним stat. Голые os-вызовы вместо
+        # методов Path: тот же syscall без сборки промежуточных объектов,
+        # а os.replace ещё и атомарно перезаписывает существующий файл
         if move_to_deleted:
-            # Перемещаем в _deleted
-            deleted_path = stories_path / "_deleted"
-            deleted_path.mkdir(exist_ok=True)
-            
-            deleted_file = deleted_path / f"{sanitized_id}.yaml"
-            file_path.rename(deleted_file)
-            logger.info(f"История перемещена в _deleted: {sanitized_id}")
+            # Перемещаем в _deleted (каталог создан при импорте модуля)
+            deleted_file = _DELETED_PATH / f"{sanitized_id}.yaml"
+            os.replace(file_path, deleted_file)
+            _invalidate_story_cache(sanitized_id)
+            logger.info("История перемещена в _deleted: %s", sanitized_id)
         else:
             # Удаляем полностью
-            file_path.unlink()
-            logger.info(f"История удалена: {sanitized_id}")
-        
+            os.unlink(file_path)
+            _invalidate_story_cache(sanitized_id)
+            logger.info("История удалена: %s", sanitized_id)
+
         return True, None
+    except FileNotFoundError:
+        return False, f"Файл истории '{sanitized_id}' не найден"
     except Exception as e:
         error_msg = f"Ошибка удаления: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
+def _scan_story_header(file_path: Path) -> Dict[str, Any]:
+    """
+    Прочитать метаданные истории потоком событий YAML без сборки объектов
+
+    Args:
+        file_path: Путь к файлу истории
+
+    Returns:
+        Словарь с ключами id, title, version, scenes_count, endings_count
+    """
+    info: Dict[str, Any] = {
+        "id": None,
+        "title": None,
+        "version": "1.0",
+        "scenes_count": 0,
+        "endings_count": 0,
+    }
+
+    # Стек открытых коллекций: события ключ/значение чередуются в мапах
+    stack: List[Dict[str, Any]] = []
+
+    # Бинарный режим: libyaml декодирует utf-8 сам (см. load_story_file)
+    with open(file_path, "rb") as f:
+        for event in yaml.parse(f, Loader=SafeLoader):
+            if isinstance(event, yaml.MappingStartEvent):
+                counting = None
+                if len(stack) == 1 and not stack[0]["key_expected"]:
+                    if stack[0]["last_key"] in ("scenes", "endings"):
+                        counting = stack[0]["last_key"]
+                stack.append({
+                    "kind": "map",
+                    "key_expected": True,
+                    "last_key": None,
+                    "counting": counting,
+                })
+            elif isinstance(event, yaml.SequenceStartEvent):
+                stack.append({"kind": "seq", "key_expected": False, "last_key": None, "counting": None})
+            elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                stack.pop()
+                if stack and stack[-1]["kind"] == "map":
+                    stack[-1]["key_expected"] = True
+            elif isinstance(event, yaml.ScalarEvent):
+                if not stack or stack[-1]["kind"] != "map":
+                    continue
+
+                top = stack[-1]
+                if top["key_expected"]:
+                    top["last_key"] = event.value
+                    top["key_expected"] = False
+
+                    # Ключ верхнего уровня внутри scenes/endings - это сцена/финал
+                    if top["counting"] == "scenes":
+                        info["scenes_count"] += 1
+                    elif top["counting"] == "endings":
+                        info["endings_count"] += 1
+                else:
+                    if len(stack) == 1 and top["last_key"] in ("id", "title", "version"):
+                        info[top["last_key"]] = event.value
+                    top["key_expected"] = True
+
+    return info
+
+def get_story_index() -> Dict[str, Dict[str, Any]]:
+    """
+    Построить лёгкий индекс историй (метаданные без полного парсинга)
+
+    Returns:
+        Словарь story_id -> {id, title, version, scenes_count, endings_count}
+    """
+    index: Dict[str, Dict[str, Any]] = {}
+
+    if not _STORIES_PATH.exists():
+        return index
+
+    yaml_files = list(_STORIES_PATH.glob("*.yaml")) + list(_STORIES_PATH.glob("*.yml"))
+
+    for file_path in yaml_files:
+        try:
+            info = _scan_story_header(file_path)
+        except yaml.YAMLError as e:
+            logger.error("Ошибка сканирования YAML %s: %s", file_path, e)
+            continue
+        except Exception as e:
+            logger.error("Ошибка чтения истории %s: %s", file_path, e)
+            continue
+
+        if info.get("id"):
+            index[info["id"]] = info
+
+    return index
+
 def get_story_summary(story_data: Dict[str, Any]) -> str:
     """
     Получить краткую сводку по истории
@@ -281,14 +690,19 @@ def get_story_summary(story_data: Dict[str, Any]) -> str:
         f"Финалов: {endings_count}"
     )
 
-def format_story_yaml(story_data: Dict[str, Any]) -> str:
+def dump_story_yaml(story_data: Dict[str, Any], stream) -> None:
     """
-    Форматирование истории в YAML строку
-    
+    Сдампить историю в байтовый поток без промежуточной строки
+
     Args:
         story_data: Данные истории
-    
-    Returns:
-        YAML строка
+        stream: Открытый бинарный поток (например, BytesIO)
     """
-    return yaml.dump(story_data, allow_unicode=True, default_flow_style=False, sort_keys=False)
+    try:
+        stream.write(dump_story(story_data).encode("utf-8"))
+    except TypeError:
+        # Данные вне схемы - откатываемся на универсальный дампер
+        yaml.dump(
+            story_data, stream, Dumper=SafeDumper,
+            encoding="utf-8", allow_unicode=True, default_flow_style=False, sort_keys=False
+        )